@@ -6,17 +6,43 @@
 
 import os
 import sys
-import json
+import stat
 import time
-import shutil
-import argparse
-import secrets
+import functools
+from functools import cached_property
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Tuple
 
+# Слабые/предсказуемые значения токенов
+_WEAK_TOKENS = frozenset({'password', 'secret', 'token', 'key'})
+
+# Эмодзи для статусов проверок
+_STATUS_EMOJI = {
+    "OK": "✅",
+    "WARNING": "⚠️",
+    "ERROR": "❌"
+}
+
+# Кэш свободного места: путь -> (время истечения, свободно байт)
+_disk_free_cache: Dict[str, Tuple[float, int]] = {}
+
+def _cached_disk_free(path: str, ttl: float = 60) -> int:
+    """Свободное место на диске с кэшированием на ttl секунд (statvfs дорог на сетевых ФС)"""
+    now = time.monotonic()
+    expires_at, free_space = _disk_free_cache.get(path, (0.0, 0))
+    if now < expires_at:
+        return free_space
+    
+    import shutil
+    free_space = shutil.disk_usage(path).free
+    _disk_free_cache[path] = (now + ttl, free_space)
+    return free_space
+
+@functools.lru_cache(maxsize=1)
 def get_settings():
-    """Получение настроек приложения"""
+    """Получение настроек приложения (кэшируется на весь процесс)"""
     try:
         from config import settings
         return settings
@@ -25,11 +51,52 @@ def get_settings():
         print("💡 Убедитесь что файл .env настроен правильно")
         sys.exit(1)
 
+class _TokenStats:
+    """Распределение токенов по длине, вычисляемое один раз за запуск"""
+    
+    def __init__(self, tokens: Dict[str, str]):
+        self.tokens = tokens
+    
+    @cached_property
+    def buckets(self) -> Tuple[int, int, int]:
+        """Количество токенов: (слабые < 16, короткие 16-31, сильные 32+)"""
+        weak = short = strong = 0
+        for token in self.tokens:
+            length = len(token)
+            if length < 16:
+                weak += 1
+            elif length < 32:
+                short += 1
+            else:
+                strong += 1
+        return weak, short, strong
+
+@functools.lru_cache(maxsize=1)
+def get_token_stats() -> _TokenStats:
+    """Общая статистика токенов для TokenManager и SystemMonitor"""
+    return _TokenStats(get_settings().client_tokens)
+
+def print_json(data: Dict):
+    """Вывод результата в JSON (orjson при наличии, иначе стандартный json)"""
+    try:
+        import orjson
+    except ImportError:
+        import json
+        json.dump(data, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+        return
+    
+    sys.stdout.flush()
+    sys.stdout.buffer.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    sys.stdout.buffer.write(b"\n")
+    sys.stdout.buffer.flush()
+
 class TokenManager:
     """Управление токенами доступа"""
     
     def __init__(self):
         self.settings = get_settings()
+        self.token_stats = get_token_stats()
     
     def list_tokens(self, output_format: str = "table") -> Dict:
         """Список всех токенов"""
@@ -62,16 +129,17 @@ class TokenManager:
     def _assess_token_quality(self, token: str) -> Dict:
         """Оценка качества токена"""
         issues = []
+        length = len(token)
         
-        if len(token) < 16:
+        if length < 16:
             issues.append("Слишком короткий (< 16 символов)")
-        elif len(token) < 32:
+        elif length < 32:
             issues.append("Короткий (рекомендуется 32+ символов)")
         
-        if token.lower() in ['password', 'secret', 'token', 'key']:
+        if token.lower() in _WEAK_TOKENS:
             issues.append("Слабый или предсказуемый")
         
-        if len(set(token)) < len(token) * 0.6:
+        if len(set(token)) < length * 0.6:
             issues.append("Низкая энтропия")
         
         # Определение уровня безопасности
@@ -88,14 +156,10 @@ class TokenManager:
     
     def _get_security_summary(self) -> Dict:
         """Сводка по безопасности токенов"""
-        tokens = list(self.settings.client_tokens.keys())
-        
-        weak_tokens = sum(1 for token in tokens if len(token) < 16)
-        short_tokens = sum(1 for token in tokens if 16 <= len(token) < 32)
-        strong_tokens = sum(1 for token in tokens if len(token) >= 32)
+        weak_tokens, short_tokens, strong_tokens = self.token_stats.buckets
         
         return {
-            "total": len(tokens),
+            "total": weak_tokens + short_tokens + strong_tokens,
             "weak": weak_tokens,
             "short": short_tokens,
             "strong": strong_tokens,
@@ -158,6 +222,8 @@ class TokenManager:
             print("⚠️  Минимальная длина токена: 16 символов")
             length = 16
         
+        import secrets
+        
         token = secrets.token_hex(length // 2)
         
         print(f"🔑 Новый токен сгенерирован:")
@@ -177,9 +243,9 @@ class TokenManager:
         return token
     
     def validate_token(self, token: str) -> bool:
-        """Проверка валидности токена"""
-        is_valid = self.settings.validate_token(token)
-        client_name = self.settings.get_client_name(token) if is_valid else None
+        """Проверка валидности токена (сравнение за постоянное время)"""
+        client_name = self.settings.find_client(token)
+        is_valid = client_name is not None
         
         print(f"🔍 Проверка токена: {token[:8]}***")
         print(f"   Статус: {'✅ Валидный' if is_valid else '❌ Неверный'}")
@@ -193,46 +259,50 @@ class SystemMonitor:
     
     def __init__(self):
         self.settings = get_settings()
+        self.token_stats = get_token_stats()
     
     def health_check(self, output_format: str = "table") -> Dict:
         """Проверка состояния системы"""
-        checks = []
-        
-        # Проверка временного каталога
-        temp_dir_check = self._check_temp_directory()
-        checks.append(temp_dir_check)
-        
-        # Проверка файлов логов
-        log_check = self._check_log_files()
-        checks.append(log_check)
-        
-        # Проверка конфигурации
-        config_check = self._check_configuration()
-        checks.append(config_check)
-        
-        # Проверка безопасности
-        security_check = self._check_security_settings()
-        checks.append(security_check)
-        
-        # Проверка производительности
-        performance_check = self._check_performance_settings()
-        checks.append(performance_check)
+        probes = (
+            self._check_temp_directory,        # Временный каталог
+            self._check_log_files,             # Файлы логов
+            self._check_configuration,         # Конфигурация
+            self._check_security_settings,     # Безопасность
+            self._check_performance_settings,  # Производительность
+        )
+        
+        # Проверки независимы, поэтому выполняются параллельно;
+        # порядок результатов совпадает с порядком запуска
+        with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+            futures = [executor.submit(self._run_timed, probe) for probe in probes]
+            checks = [future.result() for future in futures]
         
         # Сводка
         passed = sum(1 for check in checks if check["status"] == "OK")
         warnings = sum(1 for check in checks if check["status"] == "WARNING")
         errors = sum(1 for check in checks if check["status"] == "ERROR")
         
+        summary = {
+            "total": len(checks),
+            "passed": passed,
+            "warnings": warnings,
+            "errors": errors
+        }
+        
+        # Самая медленная проверка (один проход вместо сортировки)
+        timed = [check for check in checks if "duration" in check.get("details", {})]
+        if timed:
+            slowest = max(timed, key=lambda check: check["details"]["duration"])
+            summary["slowest_check"] = {
+                "name": slowest["name"],
+                "duration": slowest["details"]["duration"]
+            }
+        
         result = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
             "overall_status": "ERROR" if errors > 0 else "WARNING" if warnings > 0 else "OK",
             "checks": checks,
-            "summary": {
-                "total": len(checks),
-                "passed": passed,
-                "warnings": warnings,
-                "errors": errors
-            }
+            "summary": summary
         }
         
         if output_format == "json":
@@ -241,24 +311,35 @@ class SystemMonitor:
             self._print_health_report(result)
             return result
     
+    @staticmethod
+    def _run_timed(probe) -> Dict:
+        """Выполнение проверки с записью длительности (в секундах) в details"""
+        started = time.perf_counter()
+        check = probe()
+        check.setdefault("details", {})["duration"] = round(time.perf_counter() - started, 6)
+        return check
+    
     def _check_temp_directory(self) -> Dict:
         """Проверка временного каталога"""
-        temp_path = Path(self.settings.temp_dir)
+        temp_path = self.settings.temp_dir
         
-        if not temp_path.exists():
+        # Один stat() вместо отдельных exists() и is_dir()
+        try:
+            temp_stat = os.stat(temp_path)
+        except FileNotFoundError:
             return {
                 "name": "Временный каталог",
                 "status": "ERROR",
                 "message": f"Каталог не существует: {temp_path}",
-                "details": {"path": str(temp_path), "exists": False}
+                "details": {"path": temp_path, "exists": False}
             }
         
-        if not temp_path.is_dir():
+        if not stat.S_ISDIR(temp_stat.st_mode):
             return {
                 "name": "Временный каталог",
                 "status": "ERROR",
                 "message": f"Путь не является каталогом: {temp_path}",
-                "details": {"path": str(temp_path), "is_directory": False}
+                "details": {"path": temp_path, "is_directory": False}
             }
         
         if not os.access(temp_path, os.W_OK):
@@ -266,11 +347,11 @@ class SystemMonitor:
                 "name": "Временный каталог",
                 "status": "ERROR",
                 "message": f"Нет прав записи: {temp_path}",
-                "details": {"path": str(temp_path), "writable": False}
+                "details": {"path": temp_path, "writable": False}
             }
         
         # Проверка свободного места
-        free_space = shutil.disk_usage(temp_path).free
+        free_space = _cached_disk_free(temp_path)
         free_space_mb = free_space // (1024 * 1024)
         
         if free_space_mb < 100:  # Менее 100 MB
@@ -285,7 +366,7 @@ class SystemMonitor:
             "status": status,
             "message": message,
             "details": {
-                "path": str(temp_path),
+                "path": temp_path,
                 "exists": True,
                 "writable": True,
                 "free_space_mb": free_space_mb
@@ -294,15 +375,20 @@ class SystemMonitor:
     
     def _check_log_files(self) -> Dict:
         """Проверка файлов логов"""
-        log_path = Path(self.settings.log_file)
-        log_dir = log_path.parent
+        log_path = self.settings.log_file
+        log_dir = os.path.dirname(log_path) or "."
+        
+        try:
+            log_dir_stat = os.stat(log_dir)
+        except FileNotFoundError:
+            log_dir_stat = None
         
-        if not log_dir.exists():
+        if log_dir_stat is None or not stat.S_ISDIR(log_dir_stat.st_mode):
             return {
                 "name": "Файлы логов",
                 "status": "ERROR",
                 "message": f"Каталог логов не существует: {log_dir}",
-                "details": {"log_dir": str(log_dir), "exists": False}
+                "details": {"log_dir": log_dir, "exists": False}
             }
         
         if not os.access(log_dir, os.W_OK):
@@ -310,20 +396,24 @@ class SystemMonitor:
                 "name": "Файлы логов",
                 "status": "ERROR",
                 "message": f"Нет прав записи в каталог логов: {log_dir}",
-                "details": {"log_dir": str(log_dir), "writable": False}
+                "details": {"log_dir": log_dir, "writable": False}
             }
         
         details = {
-            "log_file": str(log_path),
-            "log_dir": str(log_dir),
+            "log_file": log_path,
+            "log_dir": log_dir,
             "rotation_enabled": self.settings.log_rotation_enabled,
             "max_size_mb": self.settings.log_max_size // (1024 * 1024),
             "backup_count": self.settings.log_backup_count
         }
         
         # Проверка размера текущего лога
-        if log_path.exists():
-            log_size = log_path.stat().st_size
+        try:
+            log_size = os.stat(log_path).st_size
+        except FileNotFoundError:
+            log_size = None
+        
+        if log_size is not None:
             log_size_mb = log_size // (1024 * 1024)
             details["current_size_mb"] = log_size_mb
             
@@ -384,13 +474,13 @@ class SystemMonitor:
         warnings = []
         
         # Проверка токенов
-        weak_tokens = [token for token in self.settings.client_tokens.keys() if len(token) < 16]
+        weak_tokens, short_tokens, _ = self.token_stats.buckets
+        
         if weak_tokens:
-            issues.append(f"Слабые токены: {len(weak_tokens)} шт.")
+            issues.append(f"Слабые токены: {weak_tokens} шт.")
         
-        short_tokens = [token for token in self.settings.client_tokens.keys() if 16 <= len(token) < 32]
         if short_tokens:
-            warnings.append(f"Короткие токены: {len(short_tokens)} шт.")
+            warnings.append(f"Короткие токены: {short_tokens} шт.")
         
         # Проверка CORS
         if not self.settings.debug and "*" in self.settings.cors_origins:
@@ -490,14 +580,13 @@ class SystemMonitor:
         print(f"   ⚠️  Предупреждений: {summary['warnings']}")
         print(f"   ❌ Ошибок: {summary['errors']}")
         print(f"   📋 Всего проверок: {summary['total']}")
+        if "slowest_check" in summary:
+            slowest = summary["slowest_check"]
+            print(f"   🐢 Самая медленная: {slowest['name']} ({slowest['duration']:.6f} с)")
     
     def _get_status_emoji(self, status: str) -> str:
         """Эмодзи для статуса"""
-        return {
-            "OK": "✅",
-            "WARNING": "⚠️",
-            "ERROR": "❌"
-        }.get(status, "❓")
+        return _STATUS_EMOJI.get(status, "❓")
 
 class MaintenanceTools:
     """Инструменты обслуживания"""
@@ -521,15 +610,25 @@ class MaintenanceTools:
         cleaned_files = 0
         freed_space = 0
         
-        for file_path in temp_dir.glob("ftp_bridge_*"):
-            try:
-                if file_path.is_file() and file_path.stat().st_mtime < cutoff_time:
-                    file_size = file_path.stat().st_size
-                    file_path.unlink()
+        # Один stat() на файл: данные DirEntry переиспользуются для проверки типа, возраста и размера
+        with os.scandir(temp_dir) as entries:
+            for entry in entries:
+                if not entry.name.startswith("ftp_bridge_"):
+                    continue
+                try:
+                    file_stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                
+                if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_mtime >= cutoff_time:
+                    continue
+                
+                try:
+                    os.unlink(entry.path)
                     cleaned_files += 1
-                    freed_space += file_size
-            except Exception as e:
-                print(f"⚠️  Не удалось удалить {file_path}: {e}")
+                    freed_space += file_stat.st_size
+                except Exception as e:
+                    print(f"⚠️  Не удалось удалить {entry.path}: {e}")
         
         freed_space_mb = freed_space // (1024 * 1024)
         
@@ -544,7 +643,7 @@ class MaintenanceTools:
     def validate_configuration(self) -> Dict:
         """Валидация конфигурации"""
         try:
-            # Попытка создать новый экземпляр настроек
+            # Попытка создать новый экземпляр настроек (в обход кэша get_settings)
             from config import Settings
             test_settings = Settings()
             
@@ -568,13 +667,14 @@ class MaintenanceTools:
         backup_path = Path(backup_dir)
         backup_path.mkdir(exist_ok=True)
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
         backup_file = backup_path / f"config_backup_{timestamp}.env"
         
         try:
             # Копирование .env файла
             env_file = Path(".env")
             if env_file.exists():
+                import shutil
                 shutil.copy2(env_file, backup_file)
                 
                 return {
@@ -598,6 +698,9 @@ class MaintenanceTools:
 
 def main():
     """Основная функция CLI"""
+    # Ленивые импорты: не нужны при импорте модуля как библиотеки
+    import argparse
+    
     parser = argparse.ArgumentParser(
         description="Административные утилиты FTP Bridge v2.0.0",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -665,7 +768,9 @@ def main():
             token_manager = TokenManager()
             
             if args.tokens_action == "list":
-                token_manager.list_tokens("json" if args.json else "table")
+                result = token_manager.list_tokens("json" if args.json else "table")
+                if args.json:
+                    print_json(result)
             elif args.tokens_action == "generate":
                 token_manager.generate_token(args.length, args.client)
             elif args.tokens_action == "validate":
@@ -679,7 +784,7 @@ def main():
             if args.monitor_action == "health":
                 result = monitor.health_check("json" if args.json else "table")
                 if args.json:
-                    print(json.dumps(result, indent=2))
+                    print_json(result)
             else:
                 monitor_parser.print_help()
         
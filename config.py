@@ -4,13 +4,28 @@
 """
 
 import os
-import secrets
-from pathlib import Path
-from typing import Dict, List, Optional, Set
+import hmac
+from typing import Dict, FrozenSet, List, Optional, Tuple, Union
 from enum import Enum
 
-from pydantic import BaseSettings, Field, validator
-from pydantic_settings import BaseSettings as PydanticBaseSettings
+from pydantic import Field, PrivateAttr, field_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+# Префикс переменных окружения с токенами клиентов
+_TOKEN_ENV_PREFIX = "FTP_BRIDGE_TOKEN_"
+_TOKEN_ENV_PREFIX_LEN = len(_TOKEN_ENV_PREFIX)
+
+# Предупреждения безопасности выводятся один раз за процесс
+_security_settings_validated = False
+
+# Разрешенные расширения по умолчанию (неизменяемые, общие для всех экземпляров)
+_DEFAULT_EXTENSIONS: FrozenSet[str] = frozenset({
+    '.txt', '.csv', '.xlsx', '.xls', '.pdf', '.zip', '.json', '.xml', '.tsv', '.dat', '.log'
+})
+
+def _split_csv(value: str) -> List[str]:
+    """Разбор строки "a, b, c" в список непустых элементов без пробелов"""
+    return [item for item in (part.strip() for part in value.split(',')) if item]
 
 class LogLevel(str, Enum):
     """Уровни логирования"""
@@ -26,14 +41,16 @@ class ProtocolType(str, Enum):
     FTPS = "ftps"
     SFTP = "sftp"
 
-class Settings(PydanticBaseSettings):
+class Settings(BaseSettings):
     """Настройки приложения через Pydantic v2 BaseSettings"""
     
     # ====== ОСНОВНЫЕ НАСТРОЙКИ СЕРВЕРА ======
-    host: str = Field(default="0.0.0.0", env="FTP_BRIDGE_HOST")
-    port: int = Field(default=8000, ge=1, le=65535, env="FTP_BRIDGE_PORT")
-    debug: bool = Field(default=False, env="FTP_BRIDGE_DEBUG")
-    degraded_mode: bool = Field(default=False, env="FTP_BRIDGE_DEGRADED_MODE")
+    host: str = Field(default="0.0.0.0")
+    port: int = Field(default=8000, ge=1, le=65535)
+    # Процессы uvicorn; rate limiting и пул соединений у каждого процесса свои
+    workers: int = Field(default=1, ge=1)
+    debug: bool = Field(default=False)
+    degraded_mode: bool = Field(default=False)
     
     # ====== БЕЗОПАСНОСТЬ И ТОКЕНЫ ======
     # КРИТИЧНО: Токены должны быть установлены через переменные окружения!
@@ -41,67 +58,100 @@ class Settings(PydanticBaseSettings):
     min_token_length: int = Field(default=32, ge=16)
     
     # ====== CORS НАСТРОЙКИ ======
-    cors_origins: List[str] = Field(
-        default=["http://localhost:3000", "http://127.0.0.1:3000"],
-        env="FTP_BRIDGE_CORS_ORIGINS"
+    # Union[..., str]: значение из окружения может быть списком через запятую
+    cors_origins: Union[List[str], str] = Field(
+        default=["http://localhost:3000", "http://127.0.0.1:3000"]
+    )
+    cors_allow_credentials: bool = Field(
+        default=True,
+        validation_alias="FTP_BRIDGE_CORS_CREDENTIALS"
+    )
+    cors_allow_methods: Union[List[str], str] = Field(
+        default=["GET"],
+        validation_alias="FTP_BRIDGE_CORS_METHODS"
     )
-    cors_allow_credentials: bool = Field(default=True, env="FTP_BRIDGE_CORS_CREDENTIALS")
-    cors_allow_methods: List[str] = Field(default=["GET"], env="FTP_BRIDGE_CORS_METHODS")
     
     # ====== FTP/SFTP НАСТРОЙКИ ======
-    default_protocol: ProtocolType = Field(default=ProtocolType.FTPS, env="FTP_BRIDGE_DEFAULT_PROTOCOL")
-    use_ftps: bool = Field(default=True, env="FTP_BRIDGE_USE_FTPS")
-    ftp_timeout: int = Field(default=30, ge=5, le=300, env="FTP_BRIDGE_FTP_TIMEOUT")
-    ftp_port: int = Field(default=21, ge=1, le=65535, env="FTP_BRIDGE_FTP_PORT")
-    sftp_port: int = Field(default=22, ge=1, le=65535, env="FTP_BRIDGE_SFTP_PORT")
-    known_hosts_path: Optional[str] = Field(default=None, env="FTP_BRIDGE_KNOWN_HOSTS_PATH")
+    default_protocol: ProtocolType = Field(default=ProtocolType.FTPS)
+    use_ftps: bool = Field(default=True)
+    ftp_timeout: int = Field(default=30, ge=5, le=300)
+    ftp_port: int = Field(default=21, ge=1, le=65535)
+    sftp_port: int = Field(default=22, ge=1, le=65535)
+    known_hosts_path: Optional[str] = Field(default=None)
     
     # ====== ФАЙЛЫ И СТРИМИНГ ======
-    temp_dir: str = Field(default="./temp", env="FTP_BRIDGE_TEMP_DIR")
-    max_file_size: int = Field(default=1073741824, ge=1, env="FTP_BRIDGE_MAX_FILE_SIZE")  # 1GB
-    chunk_size: int = Field(default=8192, ge=1024, le=1048576, env="FTP_BRIDGE_CHUNK_SIZE")  # 8KB
-    cleanup_interval: int = Field(default=3600, ge=60, env="FTP_BRIDGE_CLEANUP_INTERVAL")  # 1 час
+    temp_dir: str = Field(default="./temp")
+    max_file_size: int = Field(default=1073741824, ge=1)  # 1GB
+    chunk_size: int = Field(default=8192, ge=1024, le=1048576)  # 8KB; учитывается, только если больше min_chunk_size
+    min_chunk_size: int = Field(default=65536, ge=1024, le=8388608)  # 64KB - нижняя граница авто-настройки
+    cleanup_interval: int = Field(default=3600, ge=60)  # 1 час
+    max_concurrent_downloads: int = Field(default=64, ge=1)  # Потоки для FTP/SFTP операций
+    pool_max_idle_per_host: int = Field(default=4, ge=0)  # Простаивающие соединения на (протокол, хост, пользователь); 0 - без пула
+    pool_idle_timeout: int = Field(default=60, ge=1)  # Секунды простоя до закрытия соединения из пула
     
     # ====== RATE LIMITING ======
-    rate_limit_enabled: bool = Field(default=True, env="FTP_BRIDGE_RATE_LIMIT_ENABLED")
-    rate_limit_requests: int = Field(default=100, ge=1, env="FTP_BRIDGE_RATE_LIMIT_REQUESTS")
-    rate_limit_window: int = Field(default=3600, ge=60, env="FTP_BRIDGE_RATE_LIMIT_WINDOW")  # 1 час
+    rate_limit_enabled: bool = Field(default=True)
+    rate_limit_requests: int = Field(default=100, ge=1)
+    rate_limit_window: int = Field(default=3600, ge=60)  # 1 час
     
     # ====== ЛОГИРОВАНИЕ ======
-    log_level: LogLevel = Field(default=LogLevel.INFO, env="FTP_BRIDGE_LOG_LEVEL")
-    log_file: str = Field(default="ftp_bridge.log", env="FTP_BRIDGE_LOG_FILE")
-    log_max_size: int = Field(default=10485760, ge=1048576, env="FTP_BRIDGE_LOG_MAX_SIZE")  # 10MB
-    log_backup_count: int = Field(default=5, ge=1, le=20, env="FTP_BRIDGE_LOG_BACKUP_COUNT")
-    log_rotation_enabled: bool = Field(default=True, env="FTP_BRIDGE_LOG_ROTATION")
+    log_level: LogLevel = Field(default=LogLevel.INFO)
+    log_file: str = Field(default="ftp_bridge.log")
+    log_max_size: int = Field(default=10485760, ge=1048576)  # 10MB
+    log_backup_count: int = Field(default=5, ge=1, le=20)
+    log_rotation_enabled: bool = Field(
+        default=True,
+        validation_alias="FTP_BRIDGE_LOG_ROTATION"
+    )
     
     # ====== РАЗРЕШЕННЫЕ РАСШИРЕНИЯ ======
-    allowed_extensions: Set[str] = Field(
-        default={'.txt', '.csv', '.xlsx', '.xls', '.pdf', '.zip', '.json', '.xml', '.tsv', '.dat', '.log'},
-        env="FTP_BRIDGE_ALLOWED_EXTENSIONS"
+    allowed_extensions: Union[FrozenSet[str], str] = Field(default_factory=lambda: _DEFAULT_EXTENSIONS)
+    
+    # Неизменяемые копии, заполняются один раз при инициализации
+    _allowed_ext: frozenset = PrivateAttr(default_factory=frozenset)
+    _max_ext_len: int = PrivateAttr(default=0)
+    _cors_origins: Tuple[str, ...] = PrivateAttr(default=())
+    _token_index: Tuple[Tuple[bytes, str], ...] = PrivateAttr(default=())
+    _security_warnings: Tuple[str, ...] = PrivateAttr(default=())
+    
+    model_config = SettingsConfigDict(
+        env_prefix="FTP_BRIDGE_",
+        env_file=".env",
+        env_file_encoding="utf-8",
+        case_sensitive=False,
+        extra="ignore",  # FTP_BRIDGE_TOKEN_* и прочие переменные не являются полями
+        frozen=True,  # Настройки неизменяемы после загрузки
+        # Поля с validation_alias читаются только из FTP_BRIDGE_* переменных,
+        # в конструкторе по-прежнему доступны по имени поля
+        populate_by_name=True
     )
     
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-        case_sensitive = False
-        
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self._allowed_ext = frozenset(self.allowed_extensions)
+        self._max_ext_len = max(map(len, self._allowed_ext), default=0)
+        self._cors_origins = tuple(self.cors_origins)
         self._load_client_tokens()
+        self._security_warnings = self._collect_security_warnings()
         self._validate_security_settings()
+        self._set_compat_aliases()
     
     def _load_client_tokens(self):
         """Загрузка токенов клиентов из переменных окружения"""
         tokens = {}
+        min_length = self.min_token_length
+        env = os.environ
         
         # Загружаем токены из переменных окружения с префиксом FTP_BRIDGE_TOKEN_
-        for key, value in os.environ.items():
-            if key.startswith("FTP_BRIDGE_TOKEN_") and len(key) > 17:
-                client_name = key[17:].replace("_", " ").title()  # FTP_BRIDGE_TOKEN_CLIENT1 -> Client1
-                if len(value) >= self.min_token_length:
-                    tokens[value] = client_name
-                else:
-                    raise ValueError(f"Токен для {client_name} слишком короткий (минимум {self.min_token_length} символов)")
+        # (значения декодируются только для подходящих ключей)
+        for key in env:
+            if len(key) <= _TOKEN_ENV_PREFIX_LEN or not key.startswith(_TOKEN_ENV_PREFIX):
+                continue
+            value = env[key]
+            client_name = key[_TOKEN_ENV_PREFIX_LEN:].replace("_", " ").title()  # FTP_BRIDGE_TOKEN_CLIENT1 -> Client1
+            if len(value) < min_length:
+                raise ValueError(f"Токен для {client_name} слишком короткий (минимум {min_length} символов)")
+            tokens[value] = client_name
         
         # Проверяем наличие токенов
         if not tokens:
@@ -114,31 +164,51 @@ class Settings(PydanticBaseSettings):
                 "Генерация токена: python -c \"import secrets; print(secrets.token_hex(16))\""
             )
         
-        self.client_tokens = tokens
+        # Обход frozen: токены загружаются после базовой валидации
+        object.__setattr__(self, 'client_tokens', tokens)
+        # Заранее закодированные токены для сравнения на каждом запросе
+        self._token_index = tuple((token.encode(), name) for token, name in tokens.items())
+    
+    def _collect_security_warnings(self) -> Tuple[str, ...]:
+        """Краткие предупреждения о небезопасной конфигурации (для start.py и /health)"""
+        warnings = []
+        if not self.debug and "*" in self._cors_origins:
+            warnings.append("CORS разрешает любые домены в продакшене")
+        if not self.rate_limit_enabled:
+            warnings.append("Rate limiting отключен")
+        if self.default_protocol is ProtocolType.FTP:
+            warnings.append("Используется незашифрованный FTP протокол")
+        return tuple(warnings)
     
     def _validate_security_settings(self):
         """Валидация настроек безопасности"""
+        global _security_settings_validated
+        if _security_settings_validated:
+            return
+        _security_settings_validated = True
+        
         issues = []
         
         # Проверка продакшен настроек
         if not self.debug:  # Продакшен режим
-            if "*" in self.cors_origins or "http://localhost" in str(self.cors_origins):
+            if any(origin == "*" or origin.startswith("http://localhost") for origin in self._cors_origins):
                 issues.append("В продакшене CORS должен быть ограничен конкретными доменами")
             
-            if self.log_level == LogLevel.DEBUG:
+            if self.log_level is LogLevel.DEBUG:
                 issues.append("В продакшене не следует использовать DEBUG уровень логирования")
         
-        # Проверка токенов
-        weak_tokens = [token for token in self.client_tokens.keys() if len(token) < 32]
-        if weak_tokens:
-            issues.append(f"Найдены токены короче 32 символов: {len(weak_tokens)} шт. Рекомендуется использовать более длинные токены")
+        # Проверка токенов (при min_token_length >= 32 короткие токены уже отклонены при загрузке)
+        if self.min_token_length < 32:
+            weak_tokens = sum(1 for token in self.client_tokens if len(token) < 32)
+            if weak_tokens:
+                issues.append(f"Найдены токены короче 32 символов: {weak_tokens} шт. Рекомендуется использовать более длинные токены")
         
         # Проверка протокола по умолчанию
-        if self.default_protocol == ProtocolType.FTP:
+        if self.default_protocol is ProtocolType.FTP:
             issues.append("⚠️  ВНИМАНИЕ: Включен небезопасный FTP протокол! Рекомендуется использовать FTPS или SFTP")
         
         # Проверка SFTP настроек
-        if self.default_protocol == ProtocolType.SFTP and not self.known_hosts_path:
+        if self.default_protocol is ProtocolType.SFTP and not self.known_hosts_path:
             issues.append("Для SFTP рекомендуется настроить KNOWN_HOSTS_PATH для проверки ключей хостов")
         
         if issues:
@@ -147,123 +217,142 @@ class Settings(PydanticBaseSettings):
                 print(f"   - {issue}")
             print()
     
-    @validator('cors_origins', pre=True)
+    @field_validator('cors_origins', mode='before')
+    @classmethod
     def parse_cors_origins(cls, v):
         """Парсинг CORS origins из строки"""
         if isinstance(v, str):
-            return [origin.strip() for origin in v.split(',') if origin.strip()]
+            return _split_csv(v)
         return v
     
-    @validator('cors_allow_methods', pre=True)
+    @field_validator('cors_allow_methods', mode='before')
+    @classmethod
     def parse_cors_methods(cls, v):
         """Парсинг CORS методов из строки"""
         if isinstance(v, str):
-            return [method.strip().upper() for method in v.split(',') if method.strip()]
+            return [method.upper() for method in _split_csv(v)]
         return v
     
-    @validator('allowed_extensions', pre=True)
+    @field_validator('allowed_extensions', mode='before')
+    @classmethod
     def parse_allowed_extensions(cls, v):
         """Парсинг разрешенных расширений из строки"""
         if isinstance(v, str):
-            extensions = [ext.strip().lower() for ext in v.split(',') if ext.strip()]
-            return {ext if ext.startswith('.') else f'.{ext}' for ext in extensions}
+            extensions = (ext.lower() for ext in _split_csv(v))
+            return frozenset(ext if ext.startswith('.') else f'.{ext}' for ext in extensions)
         return v
     
     # ====== МЕТОДЫ ДЛЯ СОВМЕСТИМОСТИ ======
     
-    @property
-    def CLIENT_TOKENS(self) -> Dict[str, str]:
-        """Совместимость со старым API"""
-        return self.client_tokens
-    
-    @property
-    def HOST(self) -> str:
-        """Совместимость со старым API"""
-        return self.host
-    
-    @property
-    def PORT(self) -> int:
-        """Совместимость со старым API"""
-        return self.port
-    
-    @property
-    def DEBUG(self) -> bool:
-        """Совместимость со старым API"""
-        return self.debug
+    def _set_compat_aliases(self):
+        """Совместимость со старым API: UPPERCASE-атрибуты как обычные значения экземпляра"""
+        aliases = self.__dict__
+        aliases['CLIENT_TOKENS'] = self.client_tokens
+        aliases['HOST'] = self.host
+        aliases['PORT'] = self.port
+        aliases['DEBUG'] = self.debug
+        aliases['USE_FTPS'] = self.use_ftps
+        aliases['FTP_TIMEOUT'] = self.ftp_timeout
+        aliases['TEMP_DIR'] = self.temp_dir
+        aliases['MAX_FILE_SIZE'] = self.max_file_size
+        aliases['CHUNK_SIZE'] = self.chunk_size
+        aliases['LOG_LEVEL'] = self.log_level.value
+        aliases['LOG_FILE'] = self.log_file
     
     @property
-    def USE_FTPS(self) -> bool:
-        """Совместимость со старым API"""
-        return self.use_ftps
+    def cors_origins_frozen(self) -> Tuple[str, ...]:
+        """Неизменяемый кортеж разрешенных CORS доменов"""
+        return self._cors_origins
     
     @property
-    def FTP_TIMEOUT(self) -> int:
-        """Совместимость со старым API"""
-        return self.ftp_timeout
-    
-    @property
-    def TEMP_DIR(self) -> str:
-        """Совместимость со старым API"""
-        return self.temp_dir
-    
-    @property
-    def MAX_FILE_SIZE(self) -> int:
-        """Совместимость со старым API"""
-        return self.max_file_size
-    
-    @property
-    def CHUNK_SIZE(self) -> int:
-        """Совместимость со старым API"""
-        return self.chunk_size
-    
-    @property
-    def LOG_LEVEL(self) -> str:
-        """Совместимость со старым API"""
-        return self.log_level.value
-    
-    @property
-    def LOG_FILE(self) -> str:
-        """Совместимость со старым API"""
-        return self.log_file
+    def security_warnings(self) -> Tuple[str, ...]:
+        """Предупреждения безопасности, вычисленные при загрузке настроек"""
+        return self._security_warnings
     
     def validate_token(self, token: str) -> bool:
         """Проверка валидности токена"""
-        return token in self.client_tokens
+        return self.find_client(token) is not None
     
     def get_client_name(self, token: str) -> str:
         """Получение имени клиента по токену"""
-        return self.client_tokens.get(token, "Unknown Client")
+        client_name = self.find_client(token)
+        return client_name if client_name is not None else "Unknown Client"
+    
+    def find_client(self, token: str) -> Optional[str]:
+        """Имя клиента по токену или None; сравнение за постоянное время (защита от timing-атак)"""
+        candidate = token.encode()
+        match = None
+        for known_token, client_name in self._token_index:
+            if hmac.compare_digest(known_token, candidate):
+                match = client_name
+        return match
     
     def is_file_allowed(self, filename: str) -> bool:
         """Проверка разрешенного расширения файла"""
-        file_ext = Path(filename).suffix.lower()
-        return file_ext in self.allowed_extensions
+        # Без построения Path: точка ищется только в хвосте имени,
+        # не длиннее самого длинного разрешенного расширения
+        tail_start = max(len(filename) - self._max_ext_len, 0)
+        dot = filename.rfind('.', tail_start)
+        if dot <= 0:
+            return False
+        return filename[dot:].lower() in self._allowed_ext
     
     @staticmethod
     def generate_token(length: int = 32) -> str:
         """Генерация нового безопасного токена"""
-        return secrets.token_hex(length // 2)  # hex дает в 2 раза больше символов
+        # То же, что secrets.token_hex, но без промежуточной обертки; hex дает в 2 раза больше символов
+        return os.urandom(length // 2).hex()
 
 
-# Создание экземпляра настроек
-try:
-    settings = Settings()
-except ValueError as e:
-    print(f"❌ Ошибка конфигурации: {e}")
-    exit(1)
+# Текущий экземпляр настроек (создается при первом обращении)
+_settings: Optional[Settings] = None
+
+def _build_settings() -> Settings:
+    """Создание настроек и необходимых каталогов"""
+    new_settings = Settings()
+    
+    # Создание необходимых каталогов (mkdir только если каталога еще нет)
+    for directory in (new_settings.temp_dir, os.path.dirname(new_settings.log_file) or "."):
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+    
+    # Информация о загруженной конфигурации
+    if new_settings.debug:
+        print(f"🔧 Конфигурация загружена:")
+        print(f"   Токенов: {len(new_settings.client_tokens)}")
+        print(f"   Протокол: {new_settings.default_protocol.value}")
+        print(f"   CORS: {new_settings.cors_origins}")
+        print(f"   Rate Limit: {new_settings.rate_limit_enabled}")
+        print(f"   Макс. размер файла: {new_settings.max_file_size // (1024*1024)} MB")
+    
+    return new_settings
 
-# Создание необходимых каталогов
-temp_path = Path(settings.temp_dir)
-temp_path.mkdir(parents=True, exist_ok=True)
+def get_settings() -> Settings:
+    """Единственный экземпляр настроек на процесс (создается при первом вызове)"""
+    global _settings
+    if _settings is None:
+        try:
+            _settings = _build_settings()
+        except ValueError as e:
+            print(f"❌ Ошибка конфигурации: {e}")
+            exit(1)
+    return _settings
 
-log_path = Path(settings.log_file).parent
-log_path.mkdir(parents=True, exist_ok=True)
+def reload_settings() -> Settings:
+    """Перечитать настройки без перезапуска; при ошибке остается предыдущий экземпляр"""
+    global _settings
+    try:
+        new_settings = _build_settings()
+    except ValueError as e:
+        if _settings is None:
+            raise
+        print(f"⚠️  Не удалось перечитать конфигурацию, используются прежние настройки: {e}")
+        return _settings
+    _settings = new_settings
+    return new_settings
 
-# Информация о загруженной конфигурации
-if settings.debug:
-    print(f"🔧 Конфигурация загружена:")
-    print(f"   Токенов: {len(settings.client_tokens)}")
-    print(f"   Протокол: {settings.default_protocol.value}")
-    print(f"   CORS: {settings.cors_origins}")
-    print(f"   Rate Limit: {settings.rate_limit_enabled}")
-    print(f"   Макс. размер файла: {settings.max_file_size // (1024*1024)} MB") 
\ No newline at end of file
+def __getattr__(name: str):
+    """Совместимость: `from config import settings` через get_settings() (PEP 562)"""
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -5,27 +5,29 @@ FTP Bridge v2.1.0 - FastAPI версия
 """
 
 import os
-import tempfile
+import math
+import functools
+import time
+import atexit
+import queue
 import logging
-from logging.handlers import RotatingFileHandler
-from pathlib import Path
-from typing import Optional
+from email.utils import formatdate, parsedate_to_datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import AsyncIterator, Dict, Optional, Tuple
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Query, Depends, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
 import uvicorn
 
 from config import settings
 from storage_backend import (
-    StorageBackendFactory, 
+    BackendPool, 
+    MAX_BLOCK_SIZE,
     sanitize_path, 
     mask_user_info, 
     auto_tune_chunk_size
@@ -41,7 +43,11 @@ except ImportError:
 
 # Настройка логирования с ротацией
 def setup_logging():
-    """Настройка логирования с ротацией файлов"""
+    """
+    Настройка логирования с ротацией файлов.
+    Запись в консоль и файл выполняется фоновым QueueListener, чтобы дисковый
+    ввод-вывод логов не блокировал event loop.
+    """
     logger = logging.getLogger(__name__)
     logger.setLevel(getattr(logging, settings.log_level.value))
     
@@ -56,7 +62,6 @@ def setup_logging():
     # Console handler
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
     
     # File handler с ротацией
     if settings.log_rotation_enabled:
@@ -70,21 +75,144 @@ def setup_logging():
         file_handler = logging.FileHandler(settings.log_file, encoding='utf-8')
     
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    
+    # Обработчики работают в отдельном потоке, event loop только кладет записи в очередь
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
     
     return logger
 
 logger = setup_logging()
 
-# Rate Limiting с дефолтными лимитами
-limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["100/minute"]  # Дефолтный лимит 100 запросов в минуту
-)
-
 # Безопасность
 security = HTTPBearer()
 
+# Пул подключений к FTP/FTPS/SFTP серверам (без рукопожатия и авторизации на каждый запрос)
+backend_pool = BackendPool(
+    max_idle_per_key=settings.pool_max_idle_per_host,
+    idle_timeout=settings.pool_idle_timeout
+)
+
+# Отдельный пул потоков для FTP/SFTP операций: поток занят на все время передачи,
+# поэтому размер задается настройкой, а не берется из общего default executor
+ftp_executor = ThreadPoolExecutor(
+    max_workers=settings.max_concurrent_downloads,
+    thread_name_prefix="ftp-io"
+)
+
+# Протоколы, допустимые в параметре protocol (кроме auto)
+ALLOWED_PROTOCOLS = frozenset({"ftp", "ftps", "sftp"})
+
+# Подключения по протоколу: постоянные параметры (порт по умолчанию, таймаут, known_hosts)
+# связаны один раз, в запросе передаются только host/user/password
+_BACKEND_OPTIONS = {"port": None, "timeout": settings.ftp_timeout, "known_hosts_path": settings.known_hosts_path}
+_acquire_backend = {
+    protocol: functools.partial(backend_pool.acquire, protocol=protocol, **_BACKEND_OPTIONS)
+    for protocol in ALLOWED_PROTOCOLS
+}
+_backend_connection = {
+    protocol: functools.partial(backend_pool.connection, protocol=protocol, **_BACKEND_OPTIONS)
+    for protocol in ALLOWED_PROTOCOLS
+}
+
+# MIME типы для ответа /download
+MIME_TYPES = {
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.xls': 'application/vnd.ms-excel',
+    '.csv': 'text/csv',
+    '.txt': 'text/plain',
+    '.pdf': 'application/pdf',
+    '.zip': 'application/zip',
+    '.json': 'application/json',
+    '.xml': 'application/xml'
+}
+
+# Rate Limiting: дефолтный лимит 100 запросов в минуту на клиента
+DEFAULT_RATE_LIMIT_REQUESTS = 100
+DEFAULT_RATE_LIMIT_WINDOW = 60
+# Порог числа корзин, после которого удаляются восстановившиеся
+_RATE_LIMIT_MAX_BUCKETS = 10000
+
+class TokenBucketLimiter:
+    """
+    Ограничение частоты запросов по алгоритму token bucket.
+    Вызывается только из event loop, поэтому блокировка не нужна.
+    """
+    
+    def __init__(self, requests: int, window: float):
+        self.capacity = float(requests)
+        self.window = window
+        self.rate = requests / window  # Пополнение в секунду
+        self._state: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, last_refill)
+        self._next_prune = 0.0  # Очистка не чаще раза в window: иначе при множестве активных клиентов каждый запрос O(N)
+    
+    def consume(self, key: str) -> float:
+        """Списание одного запроса; 0 - разрешено, иначе секунды до следующей попытки"""
+        now = time.monotonic()
+        tokens, last_refill = self._state.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - last_refill) * self.rate)
+        
+        if tokens < 1:
+            self._state[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        
+        self._state[key] = (tokens - 1, now)
+        if len(self._state) > _RATE_LIMIT_MAX_BUCKETS and now >= self._next_prune:
+            # За window корзина гарантированно заполняется - такие записи не нужны
+            self._state = {k: v for k, v in self._state.items() if now - v[1] < self.window}
+            self._next_prune = now + self.window
+        return 0.0
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware для rate limiting по клиенту.
+    Ключ - имя клиента для валидного Bearer токена (клиенты за одним NAT не мешают друг другу),
+    иначе IP адрес. GET /download ограничивается своим лимитом, остальные запросы - дефолтным.
+    """
+    
+    def __init__(self, app, download_limiter: TokenBucketLimiter, default_limiter: TokenBucketLimiter):
+        self.app = app
+        self.download_limiter = download_limiter
+        self.default_limiter = default_limiter
+    
+    @staticmethod
+    def _client_key(scope) -> str:
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer":
+                    client_name = settings.find_client(token)
+                    if client_name is not None:
+                        return f"client:{client_name}"
+                break
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        if scope["method"] == "GET" and scope["path"] == "/download":
+            limiter = self.download_limiter
+        else:
+            limiter = self.default_limiter
+        
+        retry_after = limiter.consume(self._client_key(scope))
+        if retry_after:
+            response = JSONResponse(
+                {"error": f"Rate limit exceeded: {int(limiter.capacity)} per {limiter.window} seconds"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+            await response(scope, receive, send)
+            return
+        
+        await self.app(scope, receive, send)
+
 # Создание временного каталога при запуске
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -109,6 +237,8 @@ async def lifespan(app: FastAPI):
     
     yield
     # Очистка при завершении работы
+    ftp_executor.shutdown(wait=True)
+    backend_pool.close_all()
     logger.info("Приложение завершает работу")
 
 app = FastAPI(
@@ -122,30 +252,33 @@ app = FastAPI(
 
 # Rate Limiting Middleware
 if settings.rate_limit_enabled:
-    app.state.limiter = limiter
-    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-    app.add_middleware(SlowAPIMiddleware)
-    logger.info(f"Rate limiting включен с дефолтными лимитами: 100/minute")
+    app.add_middleware(
+        RateLimitMiddleware,
+        download_limiter=TokenBucketLimiter(settings.rate_limit_requests, settings.rate_limit_window),
+        default_limiter=TokenBucketLimiter(DEFAULT_RATE_LIMIT_REQUESTS, DEFAULT_RATE_LIMIT_WINDOW)
+    )
+    logger.info(f"Rate limiting включен с дефолтными лимитами: {DEFAULT_RATE_LIMIT_REQUESTS}/{DEFAULT_RATE_LIMIT_WINDOW}s")
 
 # CORS настройки с безопасной конфигурацией
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.cors_origins,
+    allow_origins=settings.cors_origins_frozen,
     allow_credentials=settings.cors_allow_credentials,
     allow_methods=settings.cors_allow_methods,
     allow_headers=["Authorization", "Content-Type"],
 )
 
 def validate_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Проверка токена доступа"""
+    """Проверка токена доступа, возвращает имя клиента (один проход по токенам)"""
     token = credentials.credentials
-    if not settings.validate_token(token):
+    client_name = settings.find_client(token)
+    if client_name is None:
         logger.warning(f"Попытка доступа с неверным токеном: {token[:8]}***")
         raise HTTPException(status_code=403, detail="Access Denied: Invalid token")
     
-    client_name = settings.get_client_name(token)
-    logger.info(f"Успешная аутентификация для клиента: {client_name}")
-    return token
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"Успешная аутентификация для клиента: {client_name}")
+    return client_name
 
 def validate_required_params(
     host: str = Query(..., description="FTP/SFTP сервер", example="ftp.example.com"),
@@ -179,8 +312,8 @@ def validate_required_params(
         logger.warning(f"Отклонен небезопасный путь: {combined_path} - {e}")
         raise HTTPException(status_code=400, detail=f"Недопустимый путь: {e}")
     
-    # Извлечение имени файла из пути
-    file_name = Path(sanitized_path).name
+    # Извлечение имени файла из пути (путь уже нормализован sanitize_path)
+    file_name = sanitized_path.rsplit('/', 1)[-1]
     if not file_name:
         raise HTTPException(status_code=400, detail="Имя файла не указано в пути")
     
@@ -194,7 +327,7 @@ def validate_required_params(
     # Определение протокола
     if protocol == "auto":
         protocol = settings.default_protocol.value
-    elif protocol not in ["ftp", "ftps", "sftp"]:
+    elif protocol not in ALLOWED_PROTOCOLS:
         raise HTTPException(status_code=400, detail="Недопустимый протокол. Используйте: ftp, ftps, sftp")
     
     # Проверка доступности SFTP
@@ -207,113 +340,384 @@ def validate_required_params(
         "password": password,
         "path": sanitized_path,
         "file_name": file_name,
-        "protocol": protocol
+        "protocol": protocol,
+        "masked_user": mask_user_info(user)  # Маскирование для логов - один раз на запрос
     }
 
-async def download_with_storage_backend(params: dict) -> tuple[str, int]:
+# Маркер окончания потока и объем данных в очереди между executor и event loop
+_STREAM_END = object()
+_STREAM_QUEUE_BYTES = 8 * 1024 * 1024
+
+class QueueWriter:
     """
-    Универсальная загрузка файла через StorageBackend
-    Возвращает (temp_file_path, file_size)
+    Файлоподобный приемник для backend.download_to_stream.
+    Копит данные до chunk_size и передает чанки в asyncio.Queue event loop'а;
+    ограниченная очередь дает backpressure - бэкенд ждет, пока клиент читает.
     """
-    temp_file = None
     
-    try:
-        # Создание временного файла
-        temp_fd, temp_file = tempfile.mkstemp(
-            dir=settings.temp_dir,
-            prefix=f'ftp_bridge_{params["protocol"]}_',
-            suffix=f'_{params["file_name"]}'
+    def __init__(self, queue: asyncio.Queue, loop: asyncio.AbstractEventLoop, chunk_size: int):
+        self.queue = queue
+        self.loop = loop
+        self.chunk_size = chunk_size
+        # Блоки копятся списком и склеиваются одним b"".join - одна копия на чанк
+        self.parts = []
+        self.buffered = 0
+        self.position = 0
+        self.closed = False
+    
+    def _put(self, item) -> None:
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+    
+    def _put_parts(self) -> None:
+        parts = self.parts
+        self._put(parts[0] if len(parts) == 1 else b"".join(parts))
+        self.parts = []
+        self.buffered = 0
+    
+    def write(self, data: bytes) -> int:
+        if self.closed:
+            raise ConnectionAbortedError("Клиент прервал загрузку")
+        size = len(data)
+        self.parts.append(data)
+        self.buffered += size
+        self.position += size
+        # Крупный блок при пустом буфере уходит как есть, без копирования
+        if self.buffered >= self.chunk_size:
+            self._put_parts()
+        return size
+    
+    def tell(self) -> int:
+        """Сколько байт записано (бэкенды считают объем загрузки по tell())"""
+        return self.position
+    
+    def flush(self) -> None:
+        if self.parts and not self.closed:
+            self._put_parts()
+    
+    def finish(self) -> None:
+        """Сигнал окончания потока (не нужен, если клиент уже отключился)"""
+        if not self.closed:
+            self._put(_STREAM_END)
+
+def _storage_http_error(params: dict, e: Exception) -> HTTPException:
+    """Преобразование ошибки хранилища в HTTPException"""
+    logger.error(f"Ошибка загрузки файла '{params['file_name']}' для пользователя {params['masked_user']}: {str(e)}")
+    
+    # Обработка различных типов ошибок
+    if "Name or service not known" in str(e) or "Connection refused" in str(e):
+        return HTTPException(status_code=500, detail=f"Не удалось подключиться к серверу: {params['host']}")
+    elif "530" in str(e) or "Login incorrect" in str(e) or "Authentication" in str(e):
+        return HTTPException(status_code=401, detail=f"Ошибка авторизации на сервере: {params['host']}")
+    elif "550" in str(e) or "No such file" in str(e):
+        return HTTPException(status_code=404, detail=f"Файл не найден: {params['path']}")
+    elif "not found in known_hosts" in str(e):
+        return HTTPException(status_code=400, detail="Ключ хоста не найден в known_hosts. Настройте KNOWN_HOSTS_PATH или добавьте ключ хоста.")
+    else:
+        return HTTPException(status_code=500, detail=f"Ошибка {params['protocol'].upper()}: {str(e)}")
+
+def _consume_result(future: asyncio.Future) -> None:
+    """Забирает исключение завершенной загрузки, чтобы asyncio не ругался на него"""
+    if not future.cancelled():
+        future.exception()
+
+class NotModifiedError(Exception):
+    """Файл не изменился с версии, которая уже есть у клиента (ответ 304)"""
+    
+    def __init__(self, headers: Dict[str, str]):
+        super().__init__("Not Modified")
+        self.headers = headers
+
+def validator_headers(file_size: int, file_mtime: Optional[float]) -> Dict[str, str]:
+    """
+    ETag и Last-Modified для условных запросов. Без mtime версию файла определить
+    нельзя - заголовки не отдаются, и клиент всегда получает файл целиком.
+    """
+    if not file_size or file_mtime is None:
+        return {}
+    return {
+        "ETag": f'W/"{file_size:x}-{int(file_mtime):x}"',
+        "Last-Modified": formatdate(file_mtime, usegmt=True)
+    }
+
+def is_not_modified(request_headers, validators: Dict[str, str], file_mtime: Optional[float]) -> bool:
+    """Проверка If-None-Match / If-Modified-Since (If-None-Match имеет приоритет, RFC 9110)"""
+    if not validators:
+        return False
+    
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Слабое сравнение: префикс W/ не учитывается
+        etag = validators["ETag"][2:]
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if (tag[2:] if tag.startswith("W/") else tag) == etag:
+                return True
+        return False
+    
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(file_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def base_chunk_size() -> int:
+    """Размер чанка из настроек, от которого отталкивается auto-chunk tuning"""
+    return max(settings.chunk_size, settings.min_chunk_size)
+
+def auto_chunk_tuned_header(file_size: int) -> str:
+    """X-Auto-Chunk-Tuned: "true", только если auto_tune_chunk_size действительно увеличил чанк"""
+    base = base_chunk_size()
+    return "true" if auto_tune_chunk_size(file_size, base) != base else "false"
+
+async def stream_from_backend(params: dict, request_headers=None) -> Tuple[AsyncIterator[bytes], int, Optional[float]]:
+    """
+    Потоковая загрузка файла через StorageBackend без промежуточного временного файла.
+    Возвращает (асинхронный итератор чанков, file_size, file_mtime); file_size == 0 - размер неизвестен.
+    Ошибки до первого байта (подключение, авторизация, файл не найден) возвращаются как HTTPException;
+    если файл не изменился относительно заголовков запроса - NotModifiedError.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"Подключение к {params['protocol'].upper()} серверу: {params['host']} для пользователя: {params['masked_user']}")
+    
+    loop = asyncio.get_running_loop()
+    producer = None
+    writer = None
+    backend = None
+    
+    def open_backend() -> Tuple[int, Optional[float]]:
+        """Подключение (или соединение из пула), проверка размера и версии файла в executor"""
+        nonlocal backend
+        backend = _acquire_backend[params['protocol']](
+            host=params['host'],
+            user=params['user'],
+            password=params['password']
         )
-        os.close(temp_fd)
+        try:
+            file_size, file_mtime = backend.get_file_stat(params['path'])
+        except Exception:
+            backend_pool.release(backend, reusable=False)
+            raise
         
-        # Маскирование пользовательских данных для логов
-        masked_user = mask_user_info(params['user'])
-        logger.info(f"Подключение к {params['protocol'].upper()} серверу: {params['host']} для пользователя: {masked_user}")
+        # Условный запрос: файл у клиента актуален - загрузка не нужна
+        if request_headers is not None:
+            validators = validator_headers(file_size, file_mtime)
+            if is_not_modified(request_headers, validators, file_mtime):
+                backend_pool.release(backend)
+                raise NotModifiedError(validators)
         
-        def storage_operations():
-            """Операции с хранилищем в executor"""
-            # Создание бэкенда
-            backend = StorageBackendFactory.create_backend(
-                protocol=params['protocol'],
-                host=params['host'],
-                port=None,  # Будет использован порт по умолчанию
-                user=params['user'],
-                password=params['password'],
-                timeout=settings.ftp_timeout,
-                known_hosts_path=settings.known_hosts_path
-            )
-            
-            with backend:
-                # Получение размера файла
-                file_size = backend.get_file_size(params['path'])
-                
-                # Проверка размера файла
-                if file_size > settings.max_file_size:
-                    raise ValueError(f"Файл слишком большой: {file_size} байт (максимум: {settings.max_file_size})")
-                
-                # Загрузка файла в поток
-                with open(temp_file, 'wb') as local_stream:
-                    downloaded_bytes = backend.download_to_stream(params['path'], local_stream)
-                
-                return downloaded_bytes
+        # Проверка размера файла
+        if file_size > settings.max_file_size:
+            backend_pool.release(backend)
+            raise ValueError(f"Файл слишком большой: {file_size} байт (максимум: {settings.max_file_size})")
+        return file_size, file_mtime
+    
+    def storage_operations() -> int:
+        """Загрузка файла в очередь в executor"""
+        reusable = False
+        try:
+            # Блок чтения растет вместе с чанком: меньше recv() и вызовов write() на файл
+            downloaded_bytes = backend.download_to_stream(params['path'], writer, min(chunk_size, MAX_BLOCK_SIZE))
+            writer.flush()
+            reusable = True
+            return downloaded_bytes
+        finally:
+            backend_pool.release(backend, reusable=reusable)
+            writer.finish()
+    
+    try:
+        file_size, file_mtime = await loop.run_in_executor(ftp_executor, open_backend)
         
-        # Выполнение операций в executor
-        loop = asyncio.get_running_loop()
-        downloaded_bytes = await loop.run_in_executor(None, storage_operations)
+        # Автоматическая настройка размера чанка
+        chunk_size = auto_tune_chunk_size(file_size, base_chunk_size())
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Стриминг файла с chunk_size: {chunk_size} байт (размер файла: {file_size} байт)")
         
-        # Финальная проверка размера файла
-        actual_file_size = os.path.getsize(temp_file)
-        if actual_file_size == 0:
-            raise HTTPException(status_code=500, detail="Загруженный файл пуст")
+        # Глубина очереди ограничена по объему, а не по числу чанков
+        chunk_queue = asyncio.Queue(maxsize=max(2, _STREAM_QUEUE_BYTES // chunk_size))
+        writer = QueueWriter(chunk_queue, loop, chunk_size)
+        producer = loop.run_in_executor(ftp_executor, storage_operations)
         
-        logger.info(f"Файл успешно загружен: {params['file_name']} ({actual_file_size} байт, протокол: {params['protocol']})")
-        return temp_file, actual_file_size
-        
-    except HTTPException:
-        if temp_file and os.path.exists(temp_file):
-            os.unlink(temp_file)
+        # Ожидание первого чанка: ошибки RETR/open еще можно вернуть нормальным статусом
+        first_chunk = await chunk_queue.get()
+        if first_chunk is _STREAM_END:
+            await producer
+            raise HTTPException(status_code=500, detail="Загруженный файл пуст")
+    except (HTTPException, NotModifiedError):
         raise
     except Exception as e:
-        if temp_file and os.path.exists(temp_file):
-            os.unlink(temp_file)
-        
-        masked_user = mask_user_info(params['user'])
-        logger.error(f"Ошибка загрузки файла '{params['file_name']}' для пользователя {masked_user}: {str(e)}")
-        
-        # Обработка различных типов ошибок
-        if "Name or service not known" in str(e) or "Connection refused" in str(e):
-            raise HTTPException(status_code=500, detail=f"Не удалось подключиться к серверу: {params['host']}")
-        elif "530" in str(e) or "Login incorrect" in str(e) or "Authentication" in str(e):
-            raise HTTPException(status_code=401, detail=f"Ошибка авторизации на сервере: {params['host']}")
-        elif "550" in str(e) or "No such file" in str(e):
-            raise HTTPException(status_code=404, detail=f"Файл не найден: {params['path']}")
-        elif "not found in known_hosts" in str(e):
-            raise HTTPException(status_code=400, detail="Ключ хоста не найден в known_hosts. Настройте KNOWN_HOSTS_PATH или добавьте ключ хоста.")
-        else:
-            raise HTTPException(status_code=500, detail=f"Ошибка {params['protocol'].upper()}: {str(e)}")
+        raise _storage_http_error(params, e)
+    
+    async def chunks():
+        chunk = first_chunk
+        try:
+            while chunk is not _STREAM_END:
+                yield chunk
+                chunk = await chunk_queue.get()
+            
+            downloaded_bytes = await producer
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"Файл успешно загружен: {params['file_name']} ({downloaded_bytes} байт, протокол: {params['protocol']})")
+        except Exception as e:
+            logger.error(f"Ошибка передачи файла '{params['file_name']}' для пользователя {params['masked_user']}: {str(e)}")
+            raise
+        finally:
+            # Остановка бэкенда, если клиент отключился раньше времени
+            writer.closed = True
+            while not chunk_queue.empty():
+                chunk_queue.get_nowait()
+            producer.add_done_callback(_consume_result)
+    
+    return chunks(), file_size, file_mtime
+
+# Одновременные запросы одного файла с теми же учетными данными обслуживаются одной загрузкой.
+# Загрузка опережает самого медленного подписчика не больше чем на _STREAM_QUEUE_BYTES:
+# прочитанные всеми чанки освобождаются, память не растет с размером файла
+_inflight_downloads: Dict[tuple, "SharedDownload"] = {}
 
-def file_streamer(file_path: str, file_size: int):
-    """Генератор для стриминга файла по частям с автоматической настройкой chunk size"""
-    # Автоматическая настройка размера чанка
-    chunk_size = auto_tune_chunk_size(file_size, settings.chunk_size)
+class SharedDownload:
+    """
+    Одна загрузка с сервера для нескольких одновременных запросов.
+    Чанки держатся в общем окне, каждый подписчик читает его со своей позиции;
+    присоединиться можно, пока начало файла еще в окне.
+    Когда все подписчики отключились, загрузка останавливается.
+    """
     
-    logger.info(f"Стриминг файла с chunk_size: {chunk_size} байт (размер файла: {file_size} байт)")
+    def __init__(self, key: tuple):
+        self.key = key
+        self.ready = asyncio.get_running_loop().create_future()  # (file_size, file_mtime) или None - без совместной загрузки
+        self.chunks = []
+        self.base = 0       # Номер чанка chunks[0] от начала файла
+        self.buffered = 0   # Байт в окне
+        self.positions: Dict[int, int] = {}  # Подписчик -> номер следующего чанка
+        self._next_reader = 0
+        self.finished = False
+        self.cancelled = False
+        self.error: Optional[Exception] = None
+        self.pump_task: Optional[asyncio.Task] = None
+        self._condition = asyncio.Condition()
     
-    try:
-        with open(file_path, 'rb') as f:
+    def forget(self) -> None:
+        """Новые запросы больше не присоединяются к этой загрузке"""
+        if _inflight_downloads.get(self.key) is self:
+            del _inflight_downloads[self.key]
+    
+    def join(self) -> Optional[AsyncIterator[bytes]]:
+        """Новый подписчик с начала файла; None - загрузка отменена или начало уже вытеснено из окна"""
+        if self.cancelled or self.base > 0:
+            return None
+        reader_id = self._next_reader
+        self._next_reader += 1
+        self.positions[reader_id] = 0
+        return self.read(reader_id)
+    
+    def _trim(self) -> bool:
+        """Освобождение чанков, прочитанных всеми подписчиками"""
+        oldest = min(self.positions.values(), default=self.base + len(self.chunks))
+        drop = oldest - self.base
+        if drop <= 0:
+            return False
+        self.buffered -= sum(len(chunk) for chunk in self.chunks[:drop])
+        del self.chunks[:drop]
+        self.base = oldest
+        return True
+    
+    async def _notify(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+    
+    async def pump(self, source: AsyncIterator[bytes]) -> None:
+        """Перекачка чанков из бэкенда в общее окно с ожиданием самого медленного подписчика"""
+        try:
+            async for chunk in source:
+                async with self._condition:
+                    self.chunks.append(chunk)
+                    self.buffered += len(chunk)
+                    self._condition.notify_all()
+                    await self._condition.wait_for(lambda: self.buffered < _STREAM_QUEUE_BYTES)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self.forget()
+            await source.aclose()
+            await self._notify()
+    
+    async def read(self, reader_id: int) -> AsyncIterator[bytes]:
+        """Чанки для одного подписчика"""
+        try:
             while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
+                async with self._condition:
+                    await self._condition.wait_for(
+                        lambda: self.positions[reader_id] - self.base < len(self.chunks) or self.finished
+                    )
+                    index = self.positions[reader_id] - self.base
+                    if index >= len(self.chunks):
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    chunk = self.chunks[index]
+                    self.positions[reader_id] += 1
+                    if self._trim():
+                        self._condition.notify_all()
                 yield chunk
-    finally:
-        # Удаление временного файла после отправки
-        if os.path.exists(file_path):
-            try:
-                os.unlink(file_path)
-                logger.info(f"Временный файл удален: {file_path}")
-            except Exception as e:
-                logger.error(f"Ошибка удаления временного файла {file_path}: {e}")
+        finally:
+            del self.positions[reader_id]
+            if not self.positions and not self.finished:
+                self.cancelled = True
+                self.forget()
+                self.pump_task.cancel()
+            elif self._trim():
+                # Отключился самый медленный подписчик - загрузка может идти дальше
+                asyncio.ensure_future(self._notify())
+
+async def open_download(params: dict, request_headers) -> Tuple[AsyncIterator[bytes], int, Optional[float]]:
+    """
+    Поток файла для /download: присоединение к уже идущей загрузке того же файла
+    или новая загрузка через stream_from_backend
+    """
+    key = backend_pool.make_key(
+        params['protocol'], params['host'], None, params['user'], params['password']
+    ) + (params['path'],)
+    
+    shared = _inflight_downloads.get(key)
+    if shared is not None:
+        stat = await shared.ready
+        if stat is not None:
+            file_size, file_mtime = stat
+            validators = validator_headers(file_size, file_mtime)
+            if is_not_modified(request_headers, validators, file_mtime):
+                raise NotModifiedError(validators)
+            reader = shared.join()
+            if reader is not None:
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(f"Присоединение к идущей загрузке: {params['file_name']} ({file_size} байт)")
+                return reader, file_size, file_mtime
+        # Загрузка не состоялась, не совместная или ушла дальше начала файла - выполняем свою
+        return await stream_from_backend(params, request_headers)
+    
+    shared = SharedDownload(key)
+    _inflight_downloads[key] = shared
+    try:
+        chunks, file_size, file_mtime = await stream_from_backend(params, request_headers)
+    except BaseException:
+        shared.forget()
+        shared.ready.set_result(None)
+        raise
+    
+    # Без размера нет валидаторов версии - такие загрузки не объединяются
+    if not file_size:
+        shared.forget()
+        shared.ready.set_result(None)
+        return chunks, file_size, file_mtime
+    
+    reader = shared.join()
+    shared.pump_task = asyncio.ensure_future(shared.pump(chunks))
+    shared.ready.set_result((file_size, file_mtime))
+    return reader, file_size, file_mtime
 
 @app.get("/")
 async def root():
@@ -341,8 +745,9 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Проверка состояния сервиса с расширенной диагностикой"""
-    temp_dir_exists = os.path.exists(settings.temp_dir)
-    temp_dir_writable = os.access(settings.temp_dir, os.W_OK) if temp_dir_exists else False
+    # access() для несуществующего каталога возвращает False - в штатном случае один системный вызов
+    temp_dir_writable = os.access(settings.temp_dir, os.W_OK)
+    temp_dir_exists = temp_dir_writable or os.path.exists(settings.temp_dir)
     
     # Определение общего статуса
     if settings.degraded_mode:
@@ -361,6 +766,7 @@ async def health_check():
         "active_tokens": len(settings.client_tokens),
         "protocols_available": ["ftp", "ftps"] + (["sftp"] if SFTP_AVAILABLE else []),
         "rate_limit_enabled": settings.rate_limit_enabled,
+        "security_warnings": list(settings.security_warnings),
         "default_protocol": settings.default_protocol.value,
         "sftp_host_key_verification": bool(settings.known_hosts_path)
     }
@@ -369,37 +775,34 @@ async def health_check():
 async def head_download_file(
     request: Request,
     params: dict = Depends(validate_required_params),
-    token: str = Depends(validate_token)
+    client_name: str = Depends(validate_token)
 ):
     """
     HEAD запрос для получения метаданных файла без его загрузки.
     Используется для preflight запросов от Power BI и других клиентов.
     """
     try:
-        # Маскирование пользовательских данных для логов
-        masked_user = mask_user_info(params['user'])
-        logger.info(f"HEAD запрос к {params['protocol'].upper()} серверу: {params['host']} для пользователя: {masked_user}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"HEAD запрос к {params['protocol'].upper()} серверу: {params['host']} для пользователя: {params['masked_user']}")
         
         def get_file_metadata():
             """Получение метаданных файла"""
-            backend = StorageBackendFactory.create_backend(
-                protocol=params['protocol'],
+            with _backend_connection[params['protocol']](
                 host=params['host'],
-                port=None,
                 user=params['user'],
-                password=params['password'],
-                timeout=settings.ftp_timeout,
-                known_hosts_path=settings.known_hosts_path
-            )
-            
-            with backend:
-                file_size = backend.get_file_size(params['path'])
+                password=params['password']
+            ) as backend:
+                file_size, file_mtime = backend.get_file_stat(params['path'])
                 protocol_name = backend.get_protocol_name()
-                return file_size, protocol_name
+                return file_size, file_mtime, protocol_name
         
         # Выполнение операций в executor
         loop = asyncio.get_running_loop()
-        file_size, protocol_name = await loop.run_in_executor(None, get_file_metadata)
+        file_size, file_mtime, protocol_name = await loop.run_in_executor(ftp_executor, get_file_metadata)
+        
+        validators = validator_headers(file_size, file_mtime)
+        if is_not_modified(request.headers, validators, file_mtime):
+            return Response(status_code=304, headers=validators)
         
         # Проверка размера файла
         if file_size > settings.max_file_size:
@@ -408,39 +811,38 @@ async def head_download_file(
                 detail=f"Файл слишком большой: {file_size} байт (максимум: {settings.max_file_size})"
             )
         
-        client_name = settings.get_client_name(token)
-        logger.info(f"HEAD запрос обработан для клиента '{client_name}': {params['file_name']} "
-                   f"(размер: {file_size} байт, протокол: {protocol_name})")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"HEAD запрос обработан для клиента '{client_name}': {params['file_name']} "
+                       f"(размер: {file_size} байт, протокол: {protocol_name})")
         
-        # Возврат заголовков без тела ответа
-        return StreamingResponse(
-            iter([]),  # Пустой итератор для HEAD запроса
+        # Возврат заголовков без тела ответа: один send, без генератора и threadpool
+        return Response(
+            content=b"",
             status_code=200,
             headers={
                 "X-File-Size": str(file_size),
                 "X-Protocol": protocol_name,
                 "X-File-Name": params['file_name'],
+                # Те же заголовки, что у GET /download (семантика HEAD)
+                "X-Auto-Chunk-Tuned": auto_chunk_tuned_header(file_size),
                 "Content-Length": str(file_size),
-                "Cache-Control": "no-cache"
+                "Cache-Control": "no-cache",
+                **validators
             }
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        masked_user = mask_user_info(params['user'])
-        logger.error(f"Ошибка HEAD запроса для файла '{params['file_name']}' пользователя {masked_user}: {str(e)}")
+        logger.error(f"Ошибка HEAD запроса для файла '{params['file_name']}' пользователя {params['masked_user']}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка получения метаданных: {str(e)}")
 
-# Rate limiting для основного эндпоинта (помимо дефолтного)
-rate_limit_str = f"{settings.rate_limit_requests}/{settings.rate_limit_window}seconds" if settings.rate_limit_enabled else None
-
+# Rate limiting для основного эндпоинта - в RateLimitMiddleware (settings.rate_limit_requests/rate_limit_window)
 @app.get("/download")
-@limiter.limit(rate_limit_str if rate_limit_str else "1000/second")  # Fallback если rate limiting отключен
 async def download_file(
     request: Request,
     params: dict = Depends(validate_required_params),
-    token: str = Depends(validate_token)
+    client_name: str = Depends(validate_token)
 ):
     """
     Загрузка файла с FTP/FTPS/SFTP сервера и отдача клиенту через стриминг
@@ -455,52 +857,48 @@ async def download_file(
     """
     
     try:
-        # Загрузка файла через унифицированный бэкенд
-        temp_file_path, file_size = await download_with_storage_backend(params)
+        # Потоковая загрузка файла через унифицированный бэкенд
+        chunks, file_size, file_mtime = await open_download(params, request.headers)
         
-        # Определение MIME типа
-        file_extension = Path(params['file_name']).suffix.lower()
-        mime_types = {
-            '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            '.xls': 'application/vnd.ms-excel',
-            '.csv': 'text/csv',
-            '.txt': 'text/plain',
-            '.pdf': 'application/pdf',
-            '.zip': 'application/zip',
-            '.json': 'application/json',
-            '.xml': 'application/xml'
-        }
-        media_type = mime_types.get(file_extension, 'application/octet-stream')
+        # Определение MIME типа (расширение - хвост имени от последней точки)
+        file_name = params['file_name']
+        dot = file_name.rfind('.')
+        file_extension = file_name[dot:].lower() if dot > 0 else ''
+        media_type = MIME_TYPES.get(file_extension, 'application/octet-stream')
         
         # Логирование успешной операции (с маскированием PII)
-        client_name = settings.get_client_name(token)
-        masked_user = mask_user_info(params['user'])
-        logger.info(f"Отправка файла клиенту '{client_name}': {params['file_name']} "
-                   f"(размер: {file_size} байт, протокол: {params['protocol']}, "
-                   f"хост: {params['host']}, пользователь: {masked_user})")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Отправка файла клиенту '{client_name}': {params['file_name']} "
+                       f"(размер: {file_size} байт, протокол: {params['protocol']}, "
+                       f"хост: {params['host']}, пользователь: {params['masked_user']})")
         
         # Возврат стримингового ответа с оптимизированными заголовками
-        return StreamingResponse(
-            file_streamer(temp_file_path, file_size),
-            media_type=media_type,
-            headers={
-                "Content-Disposition": f'attachment; filename="{params["file_name"]}"',
-                "Content-Length": str(file_size),
-                "Cache-Control": "no-cache",
-                "X-File-Source": "FTP-Bridge",
-                "X-File-Size": str(file_size),
-                "X-Protocol-Used": params['protocol'],
-                "X-Auto-Chunk-Tuned": "true" if file_size > 10 * 1024 * 1024 else "false",
-                "Retry-After": "60"  # Для 429 ошибок rate limiting
-            }
-        )
+        headers = {
+            "Content-Disposition": f'attachment; filename="{params["file_name"]}"',
+            "Cache-Control": "no-cache",
+            "X-File-Source": "FTP-Bridge",
+            "X-File-Size": str(file_size),
+            "X-Protocol-Used": params['protocol'],
+            "X-Auto-Chunk-Tuned": auto_chunk_tuned_header(file_size),
+            "Retry-After": "60"  # Для 429 ошибок rate limiting
+        }
+        # Размер неизвестен (SIZE не поддерживается) - отдаем chunked без Content-Length
+        if file_size:
+            headers["Content-Length"] = str(file_size)
+        # Валидаторы для повторных запросов Power BI (If-None-Match / If-Modified-Since)
+        headers.update(validator_headers(file_size, file_mtime))
+        
+        return StreamingResponse(chunks, media_type=media_type, headers=headers)
         
+    except NotModifiedError as e:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Файл не изменился, ответ 304 для клиента '{client_name}': {params['file_name']}")
+        return Response(status_code=304, headers=e.headers)
     except HTTPException:
         raise
     except Exception as e:
-        masked_user = mask_user_info(params.get('user', 'unknown'))
         logger.error(f"Неожиданная ошибка при обработке файла '{params.get('file_name', 'unknown')}' "
-                    f"для пользователя {masked_user}: {str(e)}")
+                    f"для пользователя {params.get('masked_user', 'unknown')}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(e)}")
 
 if __name__ == "__main__":
@@ -508,6 +906,8 @@ if __name__ == "__main__":
         "main:app",
         host=settings.host,
         port=settings.port,
+        # uvicorn[standard] сам выбирает uvloop и httptools (loop/http="auto")
+        workers=1 if settings.debug else settings.workers,
         reload=settings.debug,
         log_level=settings.log_level.value.lower()
     ) 
\ No newline at end of file
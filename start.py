@@ -4,10 +4,10 @@
 """
 
 import socket
-import subprocess
 import sys
 import os
-from pathlib import Path
+import re
+import importlib.util
 
 def check_python_version():
     """Проверка версии Python"""
@@ -20,50 +20,64 @@ def check_python_version():
 
 def check_dependencies():
     """Проверка установки зависимостей"""
-    required_packages = [
-        'fastapi', 'uvicorn', 'pydantic', 'pydantic-settings', 
-        'slowapi', 'python-multipart'
+    # Пакет -> импортируемый модуль (python-multipart устанавливается как multipart)
+    required_packages = {
+        'fastapi': 'fastapi',
+        'uvicorn': 'uvicorn',
+        'pydantic': 'pydantic',
+        'pydantic-settings': 'pydantic_settings',
+        'python-multipart': 'multipart'
+    }
+    
+    # find_spec только ищет модуль, не выполняя его: fastapi и pydantic
+    # импортируются один раз - при запуске сервера
+    missing = [
+        package for package, module in required_packages.items()
+        if importlib.util.find_spec(module) is None
     ]
     
-    missing = []
-    for package in required_packages:
-        try:
-            __import__(package.replace('-', '_'))
-        except ImportError:
-            missing.append(package)
-    
     if missing:
         print(f"❌ Отсутствуют пакеты: {', '.join(missing)}")
         print("   Установите: pip install -r requirements.txt")
         return False
     
     # Проверка опциональных пакетов
-    try:
-        import paramiko
+    if importlib.util.find_spec('paramiko') is not None:
         print("✅ SFTP поддержка (paramiko) доступна")
-    except ImportError:
+    else:
         print("⚠️  SFTP поддержка (paramiko) недоступна")
     
     print("✅ Все основные зависимости установлены")
     return True
 
 def check_port_availability(host, port):
-    """Проверка доступности порта"""
+    """
+    Проверка доступности порта пробным bind+listen (как это сделает uvicorn).
+    connect_ex за файрволом возвращает ETIMEDOUT/EHOSTUNREACH и ошибочно
+    считает порт свободным; SO_REUSEADDR не дает ложной занятости из-за TIME_WAIT.
+    """
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(1)
-            result = s.connect_ex((host, port))
-            return result != 0
-    except Exception:
+        # Семейство адресов по самому host: "::" и "::1" требуют AF_INET6
+        family, _, _, _, address = socket.getaddrinfo(
+            host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+        )[0]
+        with socket.socket(family, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(address)
+            s.listen(1)
+            return True
+    except (OSError, OverflowError):
         return False
 
 def check_environment():
     """Проверка переменных окружения с поддержкой degraded mode"""
     print("\n🔍 Проверка конфигурации...")
     
-    # Загрузка настроек
+    # Загрузка настроек: reload_settings() при первой загрузке пробрасывает ValueError
+    # (get_settings() завершил бы процесс), дальше экземпляр берется из get_settings()
+    from config import reload_settings
     try:
-        from config import settings
+        settings = reload_settings()
         print("✅ Конфигурация успешно загружена")
         degraded_mode = False
     except ValueError as e:
@@ -87,7 +101,7 @@ def check_environment():
             os.environ['FTP_BRIDGE_TOKEN_SYSTEM'] = 'degraded_mode_placeholder_token_32chars'
         
         try:
-            from config import settings
+            settings = reload_settings()
             degraded_mode = True
             print("✅ Degraded mode настроен успешно")
         except Exception as e2:
@@ -102,11 +116,9 @@ def check_environment():
         print("🔶 Режим деградации - базовые проверки...")
         
         # Минимальные проверки для degraded mode
-        temp_dir = Path(settings.temp_dir)
-        temp_dir.mkdir(parents=True, exist_ok=True)
+        os.makedirs(settings.temp_dir, exist_ok=True)
         
-        host = settings.host if settings.host != "0.0.0.0" else "127.0.0.1"
-        if not check_port_availability(host, settings.port):
+        if not check_port_availability(settings.host, settings.port):
             print(f"❌ Порт {settings.port} уже используется")
             return False, degraded_mode
         
@@ -126,43 +138,34 @@ def check_environment():
     else:
         print(f"✅ Настроено токенов: {token_count}")
     
-    # Проверка качества токенов
-    weak_tokens = [token for token in settings.client_tokens.keys() if len(token) < 32]
+    # Проверка качества токенов (нужно только количество - без промежуточного списка)
+    weak_tokens = sum(1 for token in settings.client_tokens if len(token) < 32)
     if weak_tokens:
-        print(f"⚠️  Найдены короткие токены ({len(weak_tokens)} шт.). Рекомендуется использовать токены 32+ символов.")
-    
-    # Проверка настроек безопасности
-    security_issues = []
-    
-    if not settings.debug and "*" in settings.cors_origins:
-        security_issues.append("CORS разрешает любые домены в продакшене")
-    
-    if not settings.rate_limit_enabled:
-        security_issues.append("Rate limiting отключен")
-    
-    if settings.default_protocol.value == "ftp":
-        security_issues.append("Используется незашифрованный FTP протокол")
+        print(f"⚠️  Найдены короткие токены ({weak_tokens} шт.). Рекомендуется использовать токены 32+ символов.")
     
-    if security_issues:
+    # Проверка настроек безопасности (список вычислен при загрузке настроек)
+    if settings.security_warnings:
         print("⚠️  Предупреждения безопасности:")
-        for issue in security_issues:
+        for issue in settings.security_warnings:
             print(f"   - {issue}")
     
-    # Проверка каталогов
-    temp_dir = Path(settings.temp_dir)
-    if not temp_dir.exists():
-        print(f"📁 Создание временного каталога: {temp_dir}")
-        temp_dir.mkdir(parents=True, exist_ok=True)
+    # Проверка каталогов (makedirs с exist_ok заодно проверяет, что это каталог)
+    temp_dir = settings.temp_dir
+    try:
+        os.makedirs(temp_dir, exist_ok=True)
+        temp_dir_writable = os.access(temp_dir, os.W_OK)
+    except OSError:
+        temp_dir_writable = False
     
-    if not temp_dir.is_dir() or not os.access(temp_dir, os.W_OK):
+    if not temp_dir_writable:
         print(f"❌ Временный каталог недоступен для записи: {temp_dir}")
         return False, False
     
     print(f"✅ Временный каталог: {temp_dir}")
     
     # Проверка порта
-    host = settings.host if settings.host != "0.0.0.0" else "127.0.0.1"
-    if not check_port_availability(host, settings.port):
+    # Проверяется тот же адрес, который будет слушать сервер (в т.ч. 0.0.0.0)
+    if not check_port_availability(settings.host, settings.port):
         print(f"❌ Порт {settings.port} уже используется")
         print(f"   Измените FTP_BRIDGE_PORT или остановите другой сервис")
         return False, False
@@ -186,11 +189,16 @@ def check_environment():
     
     return True, False
 
+# Строки с токенами-примерами в env_example.txt
+_EXAMPLE_TOKEN_RE = re.compile(r"^(FTP_BRIDGE_TOKEN_(POWERBI|EXCEL|ANALYTICS))=[0-9a-fA-F]+", re.MULTILINE)
+
 def interactive_setup():
     """Интерактивная настройка при первом запуске"""
     print("\n🔧 ПЕРВОНАЧАЛЬНАЯ НАСТРОЙКА")
     print("=" * 50)
     
+    from pathlib import Path
+    
     # Проверка существования .env
     env_file = Path(".env")
     if env_file.exists():
@@ -217,26 +225,17 @@ def interactive_setup():
         }
         
         # Чтение шаблона
-        with open(example_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = example_file.read_text(encoding='utf-8')
         
-        # Замена примеров токенов на реальные
-        content = content.replace(
-            "FTP_BRIDGE_TOKEN_POWERBI=aabbccdd11223344556677889900aabbccddee",
-            f"FTP_BRIDGE_TOKEN_POWERBI={tokens['POWERBI']}"
-        )
-        content = content.replace(
-            "FTP_BRIDGE_TOKEN_EXCEL=1122334455667788990011223344556677889900",
-            f"FTP_BRIDGE_TOKEN_EXCEL={tokens['EXCEL']}"
-        )
-        content = content.replace(
-            "FTP_BRIDGE_TOKEN_ANALYTICS=9988776655443322110099887766554433221100",
-            f"FTP_BRIDGE_TOKEN_ANALYTICS={tokens['ANALYTICS']}"
+        # Замена примеров токенов на реальные - один проход по шаблону,
+        # независимо от значений-примеров в нем
+        content = _EXAMPLE_TOKEN_RE.sub(
+            lambda match: f"{match.group(1)}={tokens[match.group(2)]}",
+            content
         )
         
         # Сохранение .env файла
-        with open(env_file, 'w', encoding='utf-8') as f:
-            f.write(content)
+        env_file.write_text(content, encoding='utf-8')
         
         print("✅ Файл .env создан с новыми токенами:")
         print(f"   Power BI токен: {tokens['POWERBI']}")
@@ -254,7 +253,8 @@ def interactive_setup():
 def run_server():
     """Запуск сервера"""
     try:
-        from config import settings
+        from config import get_settings
+        settings = get_settings()
         
         print(f"\n🚀 Запуск FTP Bridge сервера...")
         print(f"   URL: http://{settings.host}:{settings.port}")
@@ -269,6 +269,7 @@ def run_server():
             "main:app",
             host=settings.host,
             port=settings.port,
+            workers=1 if settings.debug else settings.workers,
             reload=settings.debug,
             log_level=settings.log_level.value.lower(),
             access_log=True
@@ -284,6 +285,12 @@ def run_server():
 
 def main():
     """Основная функция запуска"""
+    # Блочная буферизация на время проверок: десятки print() уходят в терминал
+    # несколькими write вместо записи на каждую строку
+    line_buffered = getattr(sys.stdout, "line_buffering", False)
+    if line_buffered:
+        sys.stdout.reconfigure(line_buffering=False)
+    
     print("=" * 60)
     print("🌉 FTP Bridge v2.1.0 - Система запуска")
     print("=" * 60)
@@ -296,7 +303,7 @@ def main():
         sys.exit(1)
     
     # Интерактивная настройка при необходимости
-    if not Path(".env").exists():
+    if not os.path.exists(".env"):
         if not interactive_setup():
             sys.exit(1)
     
@@ -317,6 +324,10 @@ def main():
     else:
         print("\n🎯 Все проверки пройдены успешно!")
     
+    # Дальше вывод uvicorn и сервера - снова построчно (reconfigure сбрасывает буфер)
+    if line_buffered:
+        sys.stdout.reconfigure(line_buffering=True)
+    
     # Запуск сервера
     if not run_server():
         sys.exit(1)
@@ -5,15 +5,61 @@
 
 import os
 import re
+import time
+import hashlib
+import functools
 import tempfile
+import threading
 from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from ftplib import FTP, FTP_TLS
 from pathlib import Path
-from typing import BinaryIO, Dict, Optional, Tuple
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Размер блока чтения по умолчанию (ftplib по умолчанию читает по 8KB) и его предел:
+# recv() выделяет буфер под весь запрошенный размер, даже если пришло меньше
+DEFAULT_BLOCK_SIZE = 64 * 1024
+MAX_BLOCK_SIZE = 256 * 1024
+
+def ftp_modification_time(connection: FTP, remote_path: str) -> Optional[float]:
+    """Время изменения файла через MDTM (ответ "213 YYYYMMDDHHMMSS[.sss]" в UTC)"""
+    try:
+        response = connection.sendcmd(f'MDTM {remote_path}')
+        modified = datetime.strptime(response[4:18], '%Y%m%d%H%M%S')
+        return modified.replace(tzinfo=timezone.utc).timestamp()
+    except Exception as e:
+        logger.debug(f"MDTM недоступен для {remote_path}: {e}")
+        return None
+
+def retrieve_to_stream(connection: FTP, remote_path: str, local_stream: BinaryIO, block_size: int) -> int:
+    """
+    RETR в поток. Если поток знает свою позицию (tell), в retrbinary передается
+    сам local_stream.write - без промежуточной Python-функции на каждый блок.
+    """
+    try:
+        start = local_stream.tell()
+    except (AttributeError, OSError):
+        start = None
+    
+    if start is not None:
+        connection.retrbinary(f'RETR {remote_path}', local_stream.write, blocksize=block_size)
+        return local_stream.tell() - start
+    
+    # Поток без позиции (pipe, сокет) - считаем байты сами
+    total_bytes = 0
+    
+    def write_to_stream(data):
+        nonlocal total_bytes
+        total_bytes += local_stream.write(data)
+    
+    connection.retrbinary(f'RETR {remote_path}', write_to_stream, blocksize=block_size)
+    return total_bytes
+
 class StorageBackend(ABC):
     """Абстрактный базовый класс для систем хранения файлов"""
     
@@ -24,6 +70,7 @@ class StorageBackend(ABC):
         self.password = password
         self.timeout = timeout
         self.connection = None
+        self.pool_key = None  # Ключ в BackendPool, если бэкенд создан пулом
     
     @abstractmethod
     def connect(self) -> None:
@@ -36,8 +83,8 @@ class StorageBackend(ABC):
         pass
     
     @abstractmethod
-    def download_to_stream(self, remote_path: str, local_stream: BinaryIO) -> int:
-        """Загрузка файла в поток, возвращает количество байт"""
+    def download_to_stream(self, remote_path: str, local_stream: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> int:
+        """Загрузка файла в поток блоками block_size, возвращает количество байт"""
         pass
     
     @abstractmethod
@@ -50,6 +97,14 @@ class StorageBackend(ABC):
         """Возвращает название протокола"""
         pass
     
+    def get_file_stat(self, remote_path: str) -> Tuple[int, Optional[float]]:
+        """Размер и время изменения файла (mtime None, если сервер его не сообщает)"""
+        return self.get_file_size(remote_path), None
+    
+    def is_alive(self) -> bool:
+        """Проверка, что соединение еще пригодно для повторного использования"""
+        return self.connection is not None
+    
     def __enter__(self):
         self.connect()
         return self
@@ -66,6 +121,8 @@ class FTPBackend(StorageBackend):
             self.connection = FTP()
             self.connection.connect(self.host, self.port, self.timeout)
             self.connection.login(self.user, self.password)
+            # Двоичный режим сразу: часть серверов отвечает на SIZE в ASCII режиме 550
+            self.connection.voidcmd('TYPE I')
             logger.info(f"⚠️  UNSAFE: Подключение к незащищенному FTP серверу {self.host}:{self.port}")
         except Exception as e:
             logger.error(f"Ошибка подключения к FTP серверу {self.host}:{self.port}: {e}")
@@ -79,18 +136,14 @@ class FTPBackend(StorageBackend):
             logger.warning(f"Не удалось получить размер файла {remote_path}: {e}")
             return 0
     
-    def download_to_stream(self, remote_path: str, local_stream: BinaryIO) -> int:
+    def get_file_stat(self, remote_path: str) -> Tuple[int, Optional[float]]:
+        """Размер (SIZE) и время изменения (MDTM) файла"""
+        return self.get_file_size(remote_path), ftp_modification_time(self.connection, remote_path)
+    
+    def download_to_stream(self, remote_path: str, local_stream: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> int:
         """Загрузка файла через FTP в поток"""
-        total_bytes = 0
-        
-        def write_to_stream(data):
-            nonlocal total_bytes
-            bytes_written = local_stream.write(data)
-            total_bytes += bytes_written
-        
         try:
-            self.connection.retrbinary(f'RETR {remote_path}', write_to_stream)
-            return total_bytes
+            return retrieve_to_stream(self.connection, remote_path, local_stream, block_size)
         except Exception as e:
             logger.error(f"Ошибка загрузки файла {remote_path}: {e}")
             raise
@@ -108,6 +161,16 @@ class FTPBackend(StorageBackend):
     
     def get_protocol_name(self) -> str:
         return "ftp"
+    
+    def is_alive(self) -> bool:
+        """Проверка соединения командой NOOP"""
+        if not self.connection:
+            return False
+        try:
+            self.connection.voidcmd('NOOP')
+            return True
+        except Exception:
+            return False
 
 class FTPSBackend(StorageBackend):
     """Реализация для зашифрованного FTPS"""
@@ -120,6 +183,8 @@ class FTPSBackend(StorageBackend):
             self.connection.login(self.user, self.password)
             # Переключение в защищенный режим для передачи данных
             self.connection.prot_p()
+            # Двоичный режим сразу: часть серверов отвечает на SIZE в ASCII режиме 550
+            self.connection.voidcmd('TYPE I')
             logger.info(f"🔒 Безопасное подключение к FTPS серверу {self.host}:{self.port}")
         except Exception as e:
             logger.error(f"Ошибка подключения к FTPS серверу {self.host}:{self.port}: {e}")
@@ -133,18 +198,14 @@ class FTPSBackend(StorageBackend):
             logger.warning(f"Не удалось получить размер файла {remote_path}: {e}")
             return 0
     
-    def download_to_stream(self, remote_path: str, local_stream: BinaryIO) -> int:
+    def get_file_stat(self, remote_path: str) -> Tuple[int, Optional[float]]:
+        """Размер (SIZE) и время изменения (MDTM) файла"""
+        return self.get_file_size(remote_path), ftp_modification_time(self.connection, remote_path)
+    
+    def download_to_stream(self, remote_path: str, local_stream: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> int:
         """Загрузка файла через FTPS в поток"""
-        total_bytes = 0
-        
-        def write_to_stream(data):
-            nonlocal total_bytes
-            bytes_written = local_stream.write(data)
-            total_bytes += bytes_written
-        
         try:
-            self.connection.retrbinary(f'RETR {remote_path}', write_to_stream)
-            return total_bytes
+            return retrieve_to_stream(self.connection, remote_path, local_stream, block_size)
         except Exception as e:
             logger.error(f"Ошибка загрузки файла {remote_path}: {e}")
             raise
@@ -162,6 +223,31 @@ class FTPSBackend(StorageBackend):
     
     def get_protocol_name(self) -> str:
         return "ftps"
+    
+    def is_alive(self) -> bool:
+        """Проверка соединения командой NOOP"""
+        if not self.connection:
+            return False
+        try:
+            self.connection.voidcmd('NOOP')
+            return True
+        except Exception:
+            return False
+
+# Число одновременных SSH_FXP_READ запросов при prefetch (по 32KB каждый)
+SFTP_PREFETCH_REQUESTS = 128
+# Окно SSH канала SFTP: должно вмещать все запросы prefetch (128 x 32KB = 4MB),
+# иначе сервер упирается в окно paramiko по умолчанию (2MB) и ждет подтверждений
+SFTP_WINDOW_SIZE = 8 * 1024 * 1024
+
+@functools.lru_cache(maxsize=8)
+def load_known_hosts(path: str, mtime: int):
+    """Разбор known_hosts (кэш по пути и mtime: измененный файл читается заново)"""
+    import paramiko
+    host_keys = paramiko.HostKeys()
+    host_keys.load(path)
+    logger.info(f"🔑 Загружены ключи хостов из {path}")
+    return host_keys
 
 class SFTPClientWrapper:
     """Обертка для SFTP клиента с проверкой ключей хостов"""
@@ -175,6 +261,8 @@ class SFTPClientWrapper:
         self.known_hosts_path = known_hosts_path
         self.client = None
         self.sftp = None
+        # (путь, размер) из последнего get_file_stat - prefetch без повторного stat
+        self._last_stat = None
     
     def connect(self):
         """Подключение к SFTP серверу с проверкой ключей хостов"""
@@ -186,11 +274,17 @@ class SFTPClientWrapper:
         try:
             self.client = paramiko.SSHClient()
             
-            # Загрузка известных ключей хостов
-            if self.known_hosts_path and os.path.exists(self.known_hosts_path):
-                self.client.load_host_keys(self.known_hosts_path)
-                logger.info(f"🔑 Загружены ключи хостов из {self.known_hosts_path}")
-            else:
+            # Известные ключи хостов: файл разбирается один раз, пока не изменится его mtime
+            known_hosts_loaded = False
+            if self.known_hosts_path:
+                try:
+                    mtime = os.stat(self.known_hosts_path).st_mtime_ns
+                    # При RejectPolicy клиент ключи только читает - общий объект безопасен
+                    self.client._host_keys = load_known_hosts(self.known_hosts_path, mtime)
+                    known_hosts_loaded = True
+                except FileNotFoundError:
+                    pass
+            if not known_hosts_loaded:
                 # Загрузка системных известных ключей
                 self.client.load_system_host_keys()
                 logger.warning(f"⚠️  Используются системные ключи хостов. Рекомендуется настроить KNOWN_HOSTS_PATH")
@@ -214,7 +308,10 @@ class SFTPClientWrapper:
                 look_for_keys=False  # Не используем SSH ключи, только пароль
             )
             
-            self.sftp = self.client.open_sftp()
+            self.sftp = paramiko.SFTPClient.from_transport(
+                self.client.get_transport(),
+                window_size=SFTP_WINDOW_SIZE
+            )
             logger.info(f"🔐 Безопасное подключение к SFTP серверу {self.host}:{self.port}")
             
         except paramiko.AuthenticationException:
@@ -228,20 +325,34 @@ class SFTPClientWrapper:
     
     def get_file_size(self, remote_path: str) -> int:
         """Получение размера файла через SFTP"""
+        return self.get_file_stat(remote_path)[0]
+    
+    def get_file_stat(self, remote_path: str) -> Tuple[int, Optional[float]]:
+        """Размер и время изменения файла одним SFTP stat"""
         try:
             stat = self.sftp.stat(remote_path)
-            return stat.st_size
+            self._last_stat = (remote_path, stat.st_size)
+            return stat.st_size, stat.st_mtime
         except Exception as e:
             logger.warning(f"Не удалось получить размер файла {remote_path}: {e}")
-            return 0
+            return 0, None
     
-    def download_to_stream(self, remote_path: str, local_stream: BinaryIO) -> int:
+    def download_to_stream(self, remote_path: str, local_stream: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> int:
         """Загрузка файла через SFTP в поток"""
+        # Размер уже известен из get_file_stat - prefetch не делает свой stat (лишний round-trip)
+        file_size = None
+        if self._last_stat is not None and self._last_stat[0] == remote_path:
+            file_size = self._last_stat[1]
+        self._last_stat = None
+        
         try:
             with self.sftp.open(remote_path, 'rb') as remote_file:
+                # Конвейерная загрузка: paramiko отправляет запросы чтения заранее,
+                # вместо одного запроса на каждый read()
+                remote_file.prefetch(file_size, max_concurrent_requests=SFTP_PREFETCH_REQUESTS)
                 total_bytes = 0
                 while True:
-                    data = remote_file.read(65536)  # 64KB чанки
+                    data = remote_file.read(block_size)
                     if not data:
                         break
                     bytes_written = local_stream.write(data)
@@ -289,9 +400,13 @@ class SFTPBackend(StorageBackend):
         """Получение размера файла"""
         return self.sftp_client.get_file_size(remote_path)
     
-    def download_to_stream(self, remote_path: str, local_stream: BinaryIO) -> int:
+    def get_file_stat(self, remote_path: str) -> Tuple[int, Optional[float]]:
+        """Размер и время изменения файла"""
+        return self.sftp_client.get_file_stat(remote_path)
+    
+    def download_to_stream(self, remote_path: str, local_stream: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> int:
         """Загрузка файла в поток"""
-        return self.sftp_client.download_to_stream(remote_path, local_stream)
+        return self.sftp_client.download_to_stream(remote_path, local_stream, block_size)
     
     def close(self) -> None:
         """Закрытие SFTP соединения"""
@@ -302,6 +417,12 @@ class SFTPBackend(StorageBackend):
     
     def get_protocol_name(self) -> str:
         return "sftp"
+    
+    def is_alive(self) -> bool:
+        """Проверка активности SSH транспорта"""
+        client = self.sftp_client.client if self.sftp_client else None
+        transport = client.get_transport() if client else None
+        return bool(transport and transport.is_active())
 
 class StorageBackendFactory:
     """Фабрика для создания бэкендов хранения"""
@@ -333,6 +454,111 @@ class StorageBackendFactory:
         else:
             raise ValueError(f"Неподдерживаемый протокол: {protocol}")
 
+class BackendPool:
+    """
+    Пул подключений к хранилищам.
+    Подключенные бэкенды переиспользуются по ключу (протокол, хост, порт, пользователь, пароль),
+    чтобы не выполнять рукопожатие TCP/TLS/SSH и авторизацию на каждый запрос.
+    """
+    
+    def __init__(self, max_idle_per_key: int = 4, idle_timeout: float = 60.0):
+        self.max_idle_per_key = max_idle_per_key
+        self.idle_timeout = idle_timeout
+        self._idle: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(protocol: str, host: str, port: Optional[int], user: str, password: str) -> tuple:
+        # Пароль в ключе только в виде хэша: соединение выдается лишь с теми же учетными данными
+        password_digest = hashlib.sha256(password.encode('utf-8')).digest()
+        return (protocol.lower(), host, port, user, password_digest)
+    
+    def acquire(
+        self,
+        protocol: str,
+        host: str,
+        port: Optional[int],
+        user: str,
+        password: str,
+        timeout: int = 30,
+        known_hosts_path: Optional[str] = None
+    ) -> StorageBackend:
+        """Получение подключенного бэкенда: из пула, если есть живое соединение, иначе новое"""
+        key = self.make_key(protocol, host, port, user, password)
+        
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                entry = idle.pop() if idle else None
+            if entry is None:
+                break
+            
+            backend, last_used = entry
+            if time.monotonic() - last_used <= self.idle_timeout and backend.is_alive():
+                return backend
+            backend.close()
+        
+        backend = StorageBackendFactory.create_backend(
+            protocol=protocol,
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            timeout=timeout,
+            known_hosts_path=known_hosts_path
+        )
+        backend.connect()
+        backend.pool_key = key
+        return backend
+    
+    def release(self, backend: StorageBackend, reusable: bool = True) -> None:
+        """Возврат бэкенда в пул; после ошибок соединение закрывается"""
+        expired = []
+        now = time.monotonic()
+        
+        with self._lock:
+            # Попутно убираем соединения, простаивающие дольше idle_timeout
+            for key in list(self._idle):
+                idle = self._idle[key]
+                while idle and now - idle[0][1] > self.idle_timeout:
+                    expired.append(idle.popleft()[0])
+                if not idle:
+                    del self._idle[key]
+            
+            if reusable and backend.pool_key is not None:
+                idle = self._idle.setdefault(backend.pool_key, deque())
+                if len(idle) < self.max_idle_per_key:
+                    idle.append((backend, now))
+                    backend = None
+        
+        for stale in expired:
+            stale.close()
+        if backend is not None:
+            backend.close()
+    
+    @contextmanager
+    def connection(self, *args, **kwargs) -> Iterator[StorageBackend]:
+        """Контекстный менеджер: acquire + release (соединение не возвращается в пул при ошибке)"""
+        backend = self.acquire(*args, **kwargs)
+        try:
+            yield backend
+        except BaseException:
+            self.release(backend, reusable=False)
+            raise
+        self.release(backend)
+    
+    def close_all(self) -> None:
+        """Закрытие всех простаивающих соединений"""
+        with self._lock:
+            idle_backends = [backend for idle in self._idle.values() for backend, _ in idle]
+            self._idle.clear()
+        for backend in idle_backends:
+            backend.close()
+
+# Допустимый путь: / и дальше только буквы, цифры, _, -, . и /
+# (\Z вместо $ - $ пропускает завершающий перевод строки)
+_VALID_PATH_RE = re.compile(r"/[\w\-./]*\Z")
+
 def sanitize_path(path: str) -> str:
     """
     Санитайзер пути для защиты от path traversal атак.
@@ -341,9 +567,8 @@ def sanitize_path(path: str) -> str:
     if not path:
         raise ValueError("Путь не может быть пустым")
     
-    # Проверка на валидный путь
-    valid_path_pattern = r"^\/[\w\-\.\/]*$"
-    if not re.match(valid_path_pattern, path):
+    # Проверка на валидный путь (частый случай - путь без / в начале - без регулярного выражения)
+    if path[0] != '/' or not _VALID_PATH_RE.match(path):
         raise ValueError(f"Недопустимый путь: {path}. Разрешены только буквы, цифры, дефисы, точки и слеши.")
     
     # Дополнительные проверки безопасности
@@ -362,6 +587,7 @@ def sanitize_path(path: str) -> str:
     
     return normalized
 
+@functools.lru_cache(maxsize=4096)
 def mask_user_info(user_string: str) -> str:
     """
     Маскирование пользовательских данных для логов (защита от PII).
@@ -370,32 +596,24 @@ def mask_user_info(user_string: str) -> str:
     if not user_string:
         return user_string
     
-    # Проверка на email
-    if "@" in user_string:
-        local, domain = user_string.split("@", 1)
-        if len(local) <= 2:
-            masked_local = local[0] + "*"
-        else:
-            masked_local = local[0] + "*" * (len(local) - 1)
-        return f"{masked_local}@{domain}"
+    # Проверка на email: find + срезы вместо split (без промежуточного списка)
+    at = user_string.find("@")
+    if at > 0:
+        return user_string[0] + "*" * max(at - 1, 1) + user_string[at:]
     
     # Обычное имя пользователя
-    if len(user_string) <= 2:
+    length = len(user_string)
+    if length <= 2:
         return user_string[0] + "*"
-    else:
-        return user_string[0] + "*" * (len(user_string) - 2) + user_string[-1]
+    return user_string[0] + "*" * (length - 2) + user_string[-1]
+
+# Верхняя граница размера чанка при стриминге (8MB)
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
 
-def auto_tune_chunk_size(file_size: int, default_chunk_size: int = 8192) -> int:
+def auto_tune_chunk_size(file_size: int, min_chunk_size: int = 64 * 1024) -> int:
     """
     Автоматическая настройка размера чанка на основе размера файла.
-    Для файлов > 10MB увеличиваем chunk_size до 64KB для лучшей производительности.
+    Чанк растет как file_size / 256 (не более 256 чанков на файл) в пределах
+    от min_chunk_size до 8MB: меньше системных вызовов на больших файлах.
     """
-    # 10 MB порог
-    large_file_threshold = 10 * 1024 * 1024
-    
-    if file_size > large_file_threshold:
-        # Для больших файлов используем 64KB чанки
-        return 64 * 1024
-    else:
-        # Для маленьких файлов используем настройку по умолчанию
-        return default_chunk_size 
\ No newline at end of file
+    return min(max(min_chunk_size, file_size // 256), MAX_CHUNK_SIZE) 
\ No newline at end of file